@@ -2,32 +2,74 @@
 
 VERSION = "0.45"
 
-import sys
 import os
-import asyncio
-import logging
-from argparse import ArgumentParser
-from collections import defaultdict
-from functools import partial, reduce
+import time
+
+def process_start():
+	""" The monotonic() time at which this process started, so that start
+	    up of the interpreter itself is included in start up times. Where
+	    /proc is not available, this is now. """
+	now = time.monotonic()
+	try:
+		with open("/proc/self/stat") as fp:
+			stat = fp.read()
+		# Field 22, start time in clock ticks since boot
+		ticks = int(stat.rpartition(")")[2].split()[19])
+		age = time.clock_gettime(time.CLOCK_BOOTTIME) - \
+			ticks / os.sysconf("SC_CLK_TCK")
+	except (OSError, ValueError, IndexError, AttributeError):
+		return now
+	return now - max(age, 0)
+
+STARTED = process_start()
+
+class timed_import(object):
+	""" Time a group of imports. The breakdown is logged with --debug. """
+	times = []
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+
+	def __exit__(self, *exc):
+		self.times.append((self.name, time.perf_counter() - self.start))
+
+with timed_import("stdlib"):
+	import sys
+	import asyncio
+	import logging
+	from argparse import ArgumentParser
+	from collections import defaultdict, namedtuple
+	from functools import partial, reduce
 
 # 3rd party
-try:
-	from dbus_fast.aio import MessageBus
-	from dbus_fast.constants import BusType
-except ImportError:
-	from dbus_next.aio import MessageBus
-	from dbus_next.constants import BusType
+with timed_import("dbus"):
+	try:
+		from dbus_fast.aio import MessageBus
+		from dbus_fast.constants import BusType
+		from dbus_fast.service import ServiceInterface, method
+	except ImportError:
+		from dbus_next.aio import MessageBus
+		from dbus_next.constants import BusType
+		from dbus_next.service import ServiceInterface, method
 
 # aiovelib
-sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', 'aiovelib'))
-from aiovelib.service import Service as _Service
-from aiovelib.service import IntegerItem, TextItem, DoubleItem
-from aiovelib.client import Monitor
-from aiovelib.localsettings import Setting, SETTINGS_SERVICE
+with timed_import("aiovelib"):
+	sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', 'aiovelib'))
+	from aiovelib.service import Service as _Service
+	from aiovelib.service import IntegerItem, TextItem, DoubleItem
+	from aiovelib.client import Monitor
+	from aiovelib.localsettings import Setting, SETTINGS_SERVICE
 
 # local
-from rsservice import RsService
-from settings import SettingsMonitor
+with timed_import("local"):
+	from rsservice import RsService
+	from settings import SettingsMonitor
+	from publish import Lanes, Throttle, send_backlog
+	from variant import wrap_dbus_value, wrap_dbus_dict
+	from profiler import Profiler
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -58,13 +100,25 @@ format_v = lambda v: f"{v:.2f} V"
 format_f = lambda v: f"{v:.1f} Hz"
 format_p = lambda v: f"{v:.0f} %"
 
+input_types = {
+	0: 'Not used',
+	1: 'Grid',
+	2: 'Genset',
+	3: 'Shore'
+}
+
 def format_input_type(v):
-	return {
-		0: 'Not used',
-		1: 'Grid',
-		2: 'Genset',
-		3: 'Shore'
-	}.get(v, 'Unknown')
+	return input_types.get(v, 'Unknown')
+
+# Everything aggregate() calculates from measurements on the units
+measurements = ("/Dc/0/Voltage", "/Dc/0/Current", "/Dc/0/Power", "/Soc",
+	"/Ac/In/1/P", "/Ac/In/2/P", "/Ac/Out/P") + tuple(
+	f"/Ac/{io}/L{phase}/{q}" for io in ("In/1", "In/2", "Out")
+		for phase in range(1, 4) for q in "PIVF")
+
+# Field order of the binary stream, readers get these names on connecting
+stream_fields = measurements + ("/Ac/NumberOfAcInputs", "/Ac/NumberOfPhases",
+	"/Ac/ActiveIn/ActiveInput") + tuple(sorted(RsService.summaries))
 
 class ForcedItem(object):
 	def __init__(self, onwrite):
@@ -86,122 +140,283 @@ class ForcedDoubleItem(ForcedItem, DoubleItem):
 		ForcedItem.__init__(self, onwrite)
 		IntegerItem.__init__(self, *args, **kwargs)
 
+class LazyTextItem(object):
+	def __init__(self, text):
+		self.format_text = text
+		self._formatted = (None, None) # value, its text
+
+	def get_text(self):
+		# Override so the text is only formatted when it is asked for, and
+		# once for the current value however often it is asked for.
+		v = self.value
+		if v is None or self.format_text is None:
+			return super().get_text()
+		formatted, text = self._formatted
+		if v is not formatted:
+			text = self.format_text(v)
+			self._formatted = (v, text)
+		return text
+
+class LazyDoubleItem(LazyTextItem, DoubleItem):
+	def __init__(self, *args, text=None, **kwargs):
+		LazyTextItem.__init__(self, text)
+		DoubleItem.__init__(self, *args, **kwargs)
+
+class PathSpec(namedtuple("PathSpec", "path item value source initial "
+		"text handler args forced")):
+	""" One published path of a leader. `value` is the initial value, unless
+	    it is copied from unit path `source`, or calculated by
+	    initial(leader, service) from the first unit. Paths with a `handler`
+	    are writeable, it names the leader method that is called, with
+	    `args` bound in front of the value, when the path is written. Forced
+	    items get it as their onwrite, others as onchange. """
+	__slots__ = ()
+
+def _spec(path, item, value=None, source=None, initial=None, text=None,
+		handler=None, args=()):
+	return PathSpec(path, item, value, source, initial, text, handler, args,
+		issubclass(item, ForcedItem))
+
+def _leader_schema():
+	yield _spec("/ProductId", IntegerItem)
+	yield _spec("/ProductName", TextItem, 'AC System')
+	yield _spec("/DeviceInstance", IntegerItem,
+		initial=lambda leader, service: 512 if leader.systeminstance is None \
+			else leader.systeminstance)
+	yield _spec("/Mgmt/ProcessName", TextItem, __file__)
+	yield _spec("/Mgmt/ProcessVersion", TextItem, VERSION)
+	yield _spec("/Mgmt/Connection", TextItem, "local")
+	yield _spec("/Connected", IntegerItem, 1)
+	yield _spec("/Mgmt/ThrottleLevel", IntegerItem, 0)
+	yield _spec("/Ac/ActiveIn/ActiveInput", IntegerItem)
+
+	# AC summary
+	yield _spec("/Ac/NumberOfAcInputs", IntegerItem)
+	yield _spec("/Ac/NumberOfPhases", IntegerItem)
+	for phase in range(1, 4):
+		for inp in range(1, 3):
+			yield _spec(f"/Ac/In/{inp}/L{phase}/P", LazyDoubleItem, text=format_w)
+			yield _spec(f"/Ac/In/{inp}/L{phase}/I", LazyDoubleItem, text=format_a)
+			yield _spec(f"/Ac/In/{inp}/L{phase}/V", LazyDoubleItem, text=format_v)
+			yield _spec(f"/Ac/In/{inp}/L{phase}/F", LazyDoubleItem, text=format_f)
+
+		yield _spec(f"/Ac/Out/L{phase}/P", LazyDoubleItem, text=format_w)
+		yield _spec(f"/Ac/Out/L{phase}/I", LazyDoubleItem, text=format_a)
+		yield _spec(f"/Ac/Out/L{phase}/V", LazyDoubleItem, text=format_v)
+		yield _spec(f"/Ac/Out/L{phase}/F", LazyDoubleItem, text=format_f)
+
+	yield _spec("/Ac/Out/P", LazyDoubleItem, text=format_w)
+
+	# DC summary
+	yield _spec("/Dc/0/Voltage", LazyDoubleItem, text=format_v)
+	yield _spec("/Dc/0/Current", LazyDoubleItem, text=format_a)
+	yield _spec("/Dc/0/Power", LazyDoubleItem, text=format_w)
+	yield _spec("/Soc", LazyDoubleItem, text=format_p)
+
+	for inp in range(1, 3):
+		yield _spec(f"/Ac/In/{inp}/P", LazyDoubleItem, text=format_w)
+
+	# AC input types
+	for inp in range(1, 3):
+		yield _spec(f"/Ac/In/{inp}/Type", IntegerItem,
+			source=f"/Ac/In/{inp}/Type", text=format_input_type,
+			handler="_sync_value", args=(f"/Ac/In/{inp}/Type",))
+
+	# Custom Name
+	yield _spec("/CustomName", TextItem, handler="_set_customname")
+
+	# Control points
+	yield _spec("/Mode", IntegerItem, source="/Mode",
+		handler="_set_mode")
+	for inp in range(1, 3):
+		yield _spec(f"/Ac/In/{inp}/CurrentLimit", DoubleItem,
+			source=f"/Ac/In/{inp}/CurrentLimit",
+			handler="_set_ac_currentlimit", args=(inp,))
+	yield _spec("/Settings/Ess/MinimumSocLimit", DoubleItem,
+		source="/Settings/Ess/MinimumSocLimit",
+		handler="_set_minsoc")
+	yield _spec("/Settings/Ess/Mode", IntegerItem,
+		source="/Settings/Ess/Mode", handler="_set_ess_mode")
+	yield _spec("/Ess/DisableFeedIn", ForcedIntegerItem,
+		source="/Ess/DisableFeedIn",
+		handler="_set_disable_feedin")
+	yield _spec("/Ess/AcPowerSetpoint", ForcedIntegerItem,
+		initial=lambda leader, service: leader._get_total_setpoint(),
+		handler="_set_setpoints")
+	yield _spec("/Ess/BatteryDischargeSetpoint", ForcedDoubleItem,
+		initial=lambda leader, service: leader._get_discharge_setpoint(),
+		handler="_set_battery_discharge")
+
+	# Paths that are just synchronised
+	for item, path in (
+		(IntegerItem, "/Ac/Control/IgnoreAcIn1"),
+		(DoubleItem, "/Settings/Ac/In/CurrentLimitEnergyMeter"),
+		(IntegerItem, "/Pv/Disable"),
+		(IntegerItem, "/Ess/DisableDischarge"),
+		(IntegerItem, "/Ess/DisableCharge")):
+		yield _spec(path, item, source=path,
+			handler="_sync_value", args=(path,))
+
+	# Inverter DC power control
+	yield _spec("/Ess/UseInverterPowerSetpoint", ForcedIntegerItem,
+		source="/Ess/UseInverterPowerSetpoint",
+		handler="_sync_value", args=("/Ess/UseInverterPowerSetpoint",))
+	yield _spec("/Ess/InverterPowerSetpoint", ForcedIntegerItem,
+		handler="_set_inverter_setpoints")
+
+	# AC-coupled PV power (proxied per phase to the unit on that phase)
+	for phase in range(1, 4):
+		yield _spec(f"/Pv/L{phase}/AcCoupledPower", ForcedDoubleItem,
+			initial=lambda leader, service, phase=phase: \
+				leader._get_ac_coupled_power(phase),
+			text=format_w, handler="_set_ac_coupled_power", args=(phase,))
+
+	# Alarms
+	for p in RsService.alarm_settings:
+		yield _spec(p, IntegerItem, source=p,
+			handler="_sync_value", args=(p,))
+
+	# Capabilities, other summarised paths
+	yield _spec("/Capabilities/HasDynamicEssSupport", IntegerItem, 0)
+	for p, s in RsService.summaries.items():
+		yield _spec(p, s.make_item,
+			initial=lambda leader, service, s=s: s.initial(
+				service.get_value(s.path)))
+
+# The paths every leader publishes, in order. Built once, leaders are
+# created from it in Service.__init__.
+LEADER_SCHEMA = tuple(_leader_schema())
+LEADER_PATHS = tuple(spec.path for spec in LEADER_SCHEMA)
+
+class SnapshotInterface(ServiceInterface):
+	""" Lets a poller fetch everything the leader publishes, and the values
+	    of the individual units, in one call. """
+	def __init__(self, leader):
+		super().__init__('com.victronenergy.AcSystem')
+		self.leader = leader
+
+	@method()
+	def GetSnapshot(self, since: 't') -> 'ta{sv}a{sv}':
+		generation, values, units = self.leader.snapshot(since)
+		return [generation,
+			{ p: wrap_dbus_value(v) for p, v in values.items() },
+			{ name: wrap_dbus_dict(v) for name, v in units.items() }]
+
 class Service(_Service):
+	# Unit paths that the routing indexes depend on, see _index()
+	index_paths = frozenset(("/Ac/ActiveIn/ActiveInput", "/ProductId",
+		"/FirmwareVersion", "/Pv/L1/AcCoupledPower", "/Pv/L2/AcCoupledPower",
+		"/Pv/L3/AcCoupledPower"))
+
+	_unexported = False
+
 	def __init__(self, bus, name, service):
 		super().__init__(bus, name)
 		self.systeminstance = service.systeminstance
 		self.subservices = { service }
 		self.settings = None
 
-		# Compulsory paths
-		self.add_item(IntegerItem("/ProductId", None))
-		self.add_item(TextItem("/ProductName", 'AC System'))
-		self.add_item(IntegerItem("/DeviceInstance",
-			512 if self.systeminstance is None else self.systeminstance))
-		self.add_item(TextItem("/Mgmt/ProcessName", __file__))
-		self.add_item(TextItem("/Mgmt/ProcessVersion", VERSION))
-		self.add_item(TextItem("/Mgmt/Connection", "local"))
-		self.add_item(IntegerItem("/Connected", 1))
-
-		self.add_item(IntegerItem("/Ac/ActiveIn/ActiveInput", None))
-		self._add_device_info(service)
+		# Routing indexes: units that are AC-connected, that report
+		# AC-coupled PV on each phase, and that support DynamicEss.
+		self.connected = set()
+		self.ac_coupled = { phase: set() for phase in range(1, 4) }
+		self.dynamic_ess = set()
+		self._index(service)
+
+		# Snapshot bookkeeping, see snapshot()
+		self.paths = list(LEADER_PATHS)
+		self.generation = 0
+		self._snapshot = {}
+		self._generations = {}
+		self._removed = {}
+
+		# Lanes, see SystemMonitor.itemsChanged
+		self._fast_lane = None # Handle of a pending _publish_fast_lane
+		self._fast_lane_at = float("-inf") # Loop time of the last one
+		self._deferred = set()
+
+		# The schema paths are already in self.paths, add them without
+		# going through our add_item.
+		add_item = super().add_item
+		get_value = service.get_value
+		for path, item, value, source, initial, text, handler, args, \
+				forced in LEADER_SCHEMA:
+			if source is not None:
+				value = get_value(source)
+			elif initial is not None:
+				value = initial(self, service)
+			if handler is None:
+				add_item(item(path, value, text=text))
+				continue
+			handler = getattr(self, handler)
+			if args:
+				handler = partial(handler, *args)
+			if forced:
+				add_item(item(handler, path, value, writeable=True, text=text))
+			else:
+				add_item(item(path, value, writeable=True, onchange=handler,
+					text=text))
 
-		# AC summary
-		self.add_item(IntegerItem("/Ac/NumberOfAcInputs", None))
-		self.add_item(IntegerItem("/Ac/NumberOfPhases", None))
-		for phase in range(1, 4):
-			for inp in range(1, 3):
-				self.add_item(DoubleItem(f"/Ac/In/{inp}/L{phase}/P", None, text=format_w))
-				self.add_item(DoubleItem(f"/Ac/In/{inp}/L{phase}/I", None, text=format_a))
-				self.add_item(DoubleItem(f"/Ac/In/{inp}/L{phase}/V", None, text=format_v))
-				self.add_item(DoubleItem(f"/Ac/In/{inp}/L{phase}/F", None, text=format_f))
+		self._add_device_info(service)
+		self.update_capabilities()
 
-			self.add_item(DoubleItem(f"/Ac/Out/L{phase}/P", None, text=format_w))
-			self.add_item(DoubleItem(f"/Ac/Out/L{phase}/I", None, text=format_a))
-			self.add_item(DoubleItem(f"/Ac/Out/L{phase}/V", None, text=format_v))
-			self.add_item(DoubleItem(f"/Ac/Out/L{phase}/F", None, text=format_f))
+	async def register(self):
+		self.bus.export('/', SnapshotInterface(self))
+		await super().register()
 
-		self.add_item(DoubleItem("/Ac/Out/P", None, text=format_w))
+	def add_item(self, item):
+		super().add_item(item)
+		self.paths.append(item.path)
 
-		# DC summary
-		self.add_item(DoubleItem("/Dc/0/Voltage", None, text=format_v))
-		self.add_item(DoubleItem("/Dc/0/Current", None, text=format_a))
-		self.add_item(DoubleItem("/Dc/0/Power", None, text=format_w))
-		self.add_item(DoubleItem("/Soc", None, text=format_p))
+	def remove_item(self, path):
+		super().remove_item(path)
+		try:
+			self.paths.remove(path)
+		except ValueError:
+			pass
 
-		for inp in range(1, 3):
-			self.add_item(DoubleItem(f"/Ac/In/{inp}/P", None, text=format_w))
-
-		# AC input types
-		self.add_item(IntegerItem("/Ac/In/1/Type", service.input_type(1),
-			writeable=True,
-			onchange=lambda v: self._sync_value("/Ac/In/1/Type", v),
-			text=format_input_type))
-		self.add_item(IntegerItem("/Ac/In/2/Type", service.input_type(2),
-			writeable=True,
-			onchange=lambda v: self._sync_value("/Ac/In/2/Type", v),
-			text=format_input_type))
-
-		# Custom Name
-		self.add_item(TextItem("/CustomName", None,
-			writeable=True, onchange=self._set_customname))
-
-		# Control points
-		self.add_item(IntegerItem("/Mode", service.mode,
-			writeable=True, onchange=self._set_mode))
-		self.add_item(DoubleItem("/Ac/In/1/CurrentLimit",
-			service.ac_currentlimit(1), writeable=True,
-			onchange=partial(self._set_ac_currentlimit, 1)))
-		self.add_item(DoubleItem("/Ac/In/2/CurrentLimit",
-			service.ac_currentlimit(2), writeable=True,
-			onchange=partial(self._set_ac_currentlimit, 2)))
-		self.add_item(DoubleItem("/Settings/Ess/MinimumSocLimit",
-			service.minsoc, writeable=True, onchange=self._set_minsoc))
-		self.add_item(IntegerItem("/Settings/Ess/Mode", service.essmode,
-			writeable=True, onchange=self._set_ess_mode))
-		self.add_item(ForcedIntegerItem(self._set_disable_feedin,
-			"/Ess/DisableFeedIn", service.disable_feedin, writeable=True))
-		self.add_item(ForcedIntegerItem(self._set_setpoints,
-			"/Ess/AcPowerSetpoint", self._get_total_setpoint(), writeable=True))
-		self.add_item(ForcedDoubleItem(self._set_battery_discharge,
-			"/Ess/BatteryDischargeSetpoint", self._get_discharge_setpoint(), writeable=True))
-
-		# Paths that are just synchronised
-		for item, path in (
-			(IntegerItem, "/Ac/Control/IgnoreAcIn1"),
-			(DoubleItem, "/Settings/Ac/In/CurrentLimitEnergyMeter"),
-			(IntegerItem, "/Pv/Disable"),
-			(IntegerItem, "/Ess/DisableDischarge"),
-			(IntegerItem, "/Ess/DisableCharge")):
-			self.add_item(item(path, service.get_value(path), writeable=True,
-				onchange=lambda v, path=path: self._sync_value(path, v)))
-
-		# Inverter DC power control
-		self.add_item(ForcedIntegerItem(
-			lambda v: self._sync_value("/Ess/UseInverterPowerSetpoint", v),
-			"/Ess/UseInverterPowerSetpoint",
-			service.use_inverter_setpoint, writeable=True))
-		self.add_item(ForcedIntegerItem(self._set_inverter_setpoints,
-			"/Ess/InverterPowerSetpoint", None, writeable=True))
-
-		# AC-coupled PV power (proxied per phase to the unit on that phase)
-		for phase in range(1, 4):
-			path = f"/Pv/L{phase}/AcCoupledPower"
-			self.add_item(ForcedDoubleItem(
-				partial(self._set_ac_coupled_power, phase),
-				path, self._get_ac_coupled_power(phase),
-				writeable=True, text=format_w))
-
-		# Alarms
-		for p in RsService.alarm_settings:
-			self.add_item(IntegerItem(p, service.get_value(p),
-				writeable=True, onchange=lambda v, p=p: self._sync_value(p, v)))
-
-		# Capabilities, other summarised paths
-		self.add_item(IntegerItem("/Capabilities/HasDynamicEssSupport", 0))
-		self.update_capabilities()
-		for p, s in RsService.summaries.items():
-			self.add_item(s.make_item(p, s.initial(service.get_value(p))))
+	def snapshot(self, since=0):
+		""" Take a consistent view of all published values, and of the
+		    snapshot paths of each unit. Every change is stamped with a
+		    generation number, so that only values that changed after
+		    generation `since` are returned. A path that was removed is
+		    returned as None, a unit that left the system as an empty
+		    dict. Returns (generation, values, units). """
+		current = { p: self.get_item(p).value for p in self.paths }
+		for s in self.subservices:
+			for p in RsService.snapshot_paths:
+				current[(s.name, p)] = s.get_value(p)
+
+		changed = [k for k, v in current.items()
+			if k not in self._snapshot or self._snapshot[k] != v]
+		gone = [k for k in self._snapshot if k not in current]
+		if changed or gone:
+			self.generation += 1
+			for k in gone:
+				del self._snapshot[k]
+				del self._generations[k]
+				self._removed[k[0] if isinstance(k, tuple) else k] = \
+					self.generation
+			for k in changed:
+				self._snapshot[k] = current[k]
+				self._generations[k] = self.generation
+				self._removed.pop(k[0] if isinstance(k, tuple) else k, None)
+
+		values = {}
+		units = {}
+		for k, g in self._removed.items():
+			if g > since:
+				if k.startswith("/"):
+					values[k] = None
+				else:
+					units[k] = {}
+		for k, g in self._generations.items():
+			if g > since:
+				if isinstance(k, tuple):
+					units.setdefault(k[0], {})[k[1]] = self._snapshot[k]
+				else:
+					values[k] = self._snapshot[k]
+		return self.generation, values, units
 
 	def _set_setting(self, setting, _min, _max, v):
 		if _min <= v <= _max:
@@ -238,13 +453,12 @@ class Service(_Service):
 		return self._set_setting("/Ess/DisableFeedIn", 0, 1, v)
 
 	def _set_setpoints(self, v):
-		connected = [s for s in self.subservices if s.ac_connected]
 		try:
-			setpoint = v / len(connected)
+			setpoint = v / len(self.connected)
 		except (TypeError, ZeroDivisionError):
 			pass
 		else:
-			for service in connected:
+			for service in self.connected:
 				service.setpoint = setpoint
 		return True
 
@@ -295,10 +509,46 @@ class Service(_Service):
 
 	def update_capabilities(self):
 		with self as s:
-			s["/Capabilities/HasDynamicEssSupport"] = int(all(
-				((0xA440 <= (x.productid or 0) <= 0xA47F) and (x.firmwareversion or 0) >= 0x11713) or # Multi RS
-				((0xA480 <= (x.productid or 0) <= 0xA4BF) and (x.firmwareversion or 0) >= 0x10043)    # HS-19
-				for x in self.subservices))
+			s["/Capabilities/HasDynamicEssSupport"] = int(
+				len(self.dynamic_ess) == len(self.subservices))
+
+	def _index(self, service, paths=None):
+		""" Update the routing indexes for service, for the changed unit
+		    paths in `paths`, or all of them. Returns True if the
+		    capabilities might have changed. """
+		if paths is None or "/Ac/ActiveIn/ActiveInput" in paths:
+			if service.ac_connected:
+				self.connected.add(service)
+			else:
+				self.connected.discard(service)
+
+		for phase, units in self.ac_coupled.items():
+			if paths is None or f"/Pv/L{phase}/AcCoupledPower" in paths:
+				if service.seen(f"/Pv/L{phase}/AcCoupledPower"):
+					units.add(service)
+				else:
+					units.discard(service)
+
+		if paths is None or "/ProductId" in paths or "/FirmwareVersion" in paths:
+			if service.dynamic_ess_support:
+				self.dynamic_ess.add(service)
+			else:
+				self.dynamic_ess.discard(service)
+			return True
+		return False
+
+	def _unindex(self, service):
+		self.connected.discard(service)
+		for units in self.ac_coupled.values():
+			units.discard(service)
+		self.dynamic_ess.discard(service)
+
+	def unit_changed(self, service, values):
+		""" Called with the values a unit reported, to keep the routing
+		    indexes up to date. """
+		if not self.index_paths.isdisjoint(values):
+			if self._index(service, values):
+				self.update_capabilities()
 
 	def update_summaries(self):
 		with self as s:
@@ -306,6 +556,62 @@ class Service(_Service):
 				s[path] = summary.summarise(self)
 			s["/Ess/AcPowerSetpoint"] = self._get_total_setpoint()
 
+	async def close(self):
+		""" Release everything this leader holds: its units, its name and
+		    objects on the bus, and the bus connection itself. """
+		# Going away, so don't republish anything on the way out
+		for service in self.subservices:
+			self._unindex(service)
+		self.subservices.clear()
+		if self._fast_lane is not None:
+			self._fast_lane.cancel()
+			self._fast_lane = None
+		self._deferred.clear()
+		self._snapshot.clear()
+		self._generations.clear()
+		self._removed.clear()
+
+		self.unexport()
+		try:
+			await self.bus.release_name(self.name)
+		except Exception:
+			logger.debug("Could not release %s", self.name, exc_info=True)
+		self.bus.disconnect()
+
+	def unexport(self):
+		""" Take our objects off the bus, once. aiovelib does this in
+		    Service.__del__, which the garbage collector would otherwise
+		    run a second time, on a bus that is already disconnected. """
+		if not self._unexported:
+			self._unexported = True
+			super().__del__()
+
+	def __del__(self):
+		self.unexport()
+
+	def set_connected(self, v):
+		with self as s:
+			s["/Connected"] = v
+
+	def invalidate(self):
+		""" Invalidate the measurements, there are no units left to
+		    measure them. """
+		with self as s:
+			for p in measurements:
+				s[p] = None
+
+	def reattach(self, service):
+		""" Take over the values of the first unit to return to a retained,
+		    empty leader. What the leader holds is stale by now, so it must
+		    not be pushed to the unit. """
+		with self as s:
+			for p in RsService.synchronised_paths + RsService.alarm_settings + (
+					"/Mode", "/Ess/DisableFeedIn",
+					"/Ess/UseInverterPowerSetpoint"):
+				if (v := service.get_value(p)) is not None:
+					s[p] = v
+		self.set_connected(1)
+
 	def _remove_device_info(self, service):
 		self.remove_item(f"/Devices/{service.nad}/Service")
 		self.remove_item(f"/Devices/{service.nad}/Instance")
@@ -314,6 +620,47 @@ class Service(_Service):
 		with self as s:
 			s[path] = RsService.summaries[path].summarise(self)
 
+	def defer_summary(self, path):
+		""" Recalculate a slow lane summary on the next tick. """
+		self._deferred.add(path)
+
+	def summary_values(self):
+		""" Current summaries, including those still waiting for the next
+		    tick to be published. """
+		return { p: RsService.summaries[p].summarise(self)
+			if p in self._deferred else self.get_item(p).value
+			for p in RsService.summaries }
+
+	def flush_summaries(self):
+		if self._deferred:
+			with self as s:
+				for path in self._deferred:
+					s[path] = RsService.summaries[path].summarise(self)
+			self._deferred.clear()
+
+	def schedule_fast_lane(self, lanes):
+		""" Recalculate and publish the fast lane aggregates as soon as the
+		    loop gets to it, but no sooner than lanes.interval after the
+		    last time. Changes from several units that arrive within that
+		    interval are handled in one go. """
+		if self._fast_lane is None:
+			loop = asyncio.get_event_loop()
+			at = self._fast_lane_at + lanes.interval
+			if at > loop.time():
+				self._fast_lane = loop.call_at(at,
+					self._publish_fast_lane, lanes)
+			else:
+				self._fast_lane = loop.call_soon(
+					self._publish_fast_lane, lanes)
+
+	def _publish_fast_lane(self, lanes):
+		self._fast_lane = None
+		self._fast_lane_at = asyncio.get_event_loop().time()
+		with self as s:
+			for p, v in aggregate(self).items():
+				if lanes.is_fast(p):
+					s[p] = v
+
 	@property
 	def acpowersetpoint(self):
 		return self.get_item("/Ess/AcPowerSetpoint").value
@@ -332,54 +679,53 @@ class Service(_Service):
 
 	def _get_ac_coupled_power(self, phase):
 		path = f"/Pv/L{phase}/AcCoupledPower"
-		values = [s.get_value(path) for s in self.subservices if s.seen(path)]
+		values = [s.get_value(path) for s in self.ac_coupled[phase]]
 		return sum(values) if values else None
 
 	def _set_ac_coupled_power(self, phase, v):
 		path = f"/Pv/L{phase}/AcCoupledPower"
-		for s in self.subservices:
-			if s.seen(path):
-				s.set_value_async(path, v)
+		for s in self.ac_coupled[phase]:
+			s.set_value_async(path, v)
 		return True
 
 	def add_service(self, service):
 		self.subservices.add(service)
+		self._index(service)
 		self.update_capabilities()
 		self.update_summaries()
 		self._add_device_info(service)
 
 	def remove_service(self, service):
 		self.subservices.discard(service)
+		self._unindex(service)
 		self.update_capabilities()
 		self.update_summaries()
 		self._remove_device_info(service)
 
-	async def wait_for_settings(self):
-		""" Attempt a connection to localsettings. """
-		settingsmonitor = await SettingsMonitor.create(self.bus,
-			itemsChanged=self.itemsChanged)
-		self.settings = await asyncio.wait_for(
-			settingsmonitor.wait_for_service(SETTINGS_SERVICE), 5)
-		await self.settings.add_settings(
-			Setting("/Settings/AcSystem/{}/CustomName".format(
-				self.systeminstance), ""),
-			Setting("/Settings/Alarm/System/GridLost", 0, 0, 1),
-		)
+	@property
+	def customname_setting(self):
+		return "/Settings/AcSystem/{}/CustomName".format(self.systeminstance)
 
-	async def init(self):
-		await self.wait_for_settings()
-		self.set_customname(self.settings.get_value(
-			"/Settings/AcSystem/{}/CustomName".format(self.systeminstance)))
+	async def wait_for_settings(self, monitor):
+		""" Register our settings with the shared localsettings client. """
+		self.settings = await monitor.wait_for_settings()
+		await self.settings.add_settings(Setting(self.customname_setting, ""))
+		monitor.route_settings(self, (self.customname_setting, ) +
+			tuple(RsService.setting_dependencies))
 
-	def itemsChanged(self, service, values):
-		try:
-			self.set_customname(values[
-				"/Settings/AcSystem/{}/CustomName".format(self.systeminstance)])
-		except KeyError:
-			pass # Not a customname change
+	async def init(self, monitor):
+		await self.wait_for_settings(monitor)
+		self.set_customname(self.settings.get_value(self.customname_setting))
 
-		# Update all summaries, some might be settings dependent
-		self.update_summaries()
+	def itemsChanged(self, service, values):
+		# Only changes routed to us by SystemMonitor.settingsChanged
+		# arrive here.
+		for p, v in values.items():
+			if p == self.customname_setting:
+				self.set_customname(v)
+				continue
+			for path in RsService.setting_dependencies.get(p, ()):
+				self.update_summary(path)
 
 	@property
 	def customname(self):
@@ -392,12 +738,63 @@ class Service(_Service):
 class SystemMonitor(Monitor):
 	synchronised_paths = RsService.synchronised_paths + RsService.alarm_settings
 
-	def __init__(self, bus, make_bus):
+	def __init__(self, bus, make_bus, retention=0, lanes=None):
 		super().__init__(bus, handlers = {
 			'com.victronenergy.multi': RsService
 		})
 		self._leaders = {}
+		self._members = {} # service -> systeminstance of its leader
+		self._expiry = {} # systeminstance -> TimerHandle of empty leaders
+		self._closing = set() # Tasks closing dropped leaders
+		self._registered = False
+		self._settings = None
+		self._settingsmonitor = None
+		self._settings_routes = defaultdict(set) # setting -> leaders
 		self._make_bus = make_bus
+		self.retention = retention
+		self.lanes = Lanes() if lanes is None else lanes
+
+	async def _connect_settings(self):
+		# The monitor stays for the life of the process, after a failure
+		# only the wait for localsettings is tried again.
+		if self._settingsmonitor is None:
+			self._settingsmonitor = await SettingsMonitor.create(self.bus,
+				itemsChanged=self.settingsChanged)
+		settings = await asyncio.wait_for(
+			self._settingsmonitor.wait_for_service(SETTINGS_SERVICE), 5)
+		await settings.add_settings(
+			Setting("/Settings/Alarm/System/GridLost", 0, 0, 1),
+		)
+		return settings
+
+	async def wait_for_settings(self):
+		""" Connect to localsettings once. All leaders share this client,
+		    and the changes they are interested in are routed to them. """
+		if self._settings is None:
+			self._settings = asyncio.ensure_future(self._connect_settings())
+		try:
+			return await asyncio.shield(self._settings)
+		except Exception:
+			self._settings = None # Let the next leader try again
+			raise
+
+	def route_settings(self, leader, paths):
+		for p in paths:
+			self._settings_routes[p].add(leader)
+
+	def unroute_settings(self, leader):
+		for p, leaders in list(self._settings_routes.items()):
+			leaders.discard(leader)
+			if not leaders:
+				del self._settings_routes[p]
+
+	def settingsChanged(self, service, values):
+		changes = defaultdict(dict)
+		for p, v in values.items():
+			for leader in self._settings_routes.get(p, ()):
+				changes[leader][p] = v
+		for leader, v in changes.items():
+			leader.itemsChanged(service, v)
 
 	def get_leader(self, systeminstance):
 		try:
@@ -411,15 +808,33 @@ class SystemMonitor(Monitor):
 		# we can really place or sync things.
 		logger.debug("Waiting for essential paths")
 		await service.wait_for_essential_paths()
+		await self._join(service)
 
+	async def _join(self, service):
 		instance = service.systeminstance
 		if instance is None:
 			return # Firmware is old, or it is still starting up
 
+		if service in self._members:
+			return # Already placed
+
+		self._members[service] = instance
 		if instance in self._leaders:
-			leader = await self._leaders[instance]
+			try:
+				leader = await self._leaders[instance]
+			except asyncio.CancelledError:
+				self._members.pop(service, None)
+				raise
+
+			if (expiry := self._expiry.pop(instance, None)) is not None:
+				# A retained leader gets its unit back, pick up where
+				# the unit is rather than where the leader was.
+				expiry.cancel()
+				logger.info("Reattaching %s to %s", service.name, leader.name)
+				leader.reattach(service)
 
 			# Synchronise with the other units
+			pending = {}
 			for p in self.synchronised_paths:
 				try:
 					v = leader.get_item(p).value
@@ -427,30 +842,85 @@ class SystemMonitor(Monitor):
 					pass
 				else:
 					if v is not None and v != service.get_value(p):
-						service.set_value_async(p, v)
+						pending[p] = v
+			service.set_values_async(pending)
 
 			leader.add_service(service)
 		else:
-			self._leaders[instance] = asyncio.Future()
-			bus = await self._make_bus().connect()
-			gateway = service.gateway.replace(":", "_")
-			leader = Service(bus,
-				f"com.victronenergy.acsystem.{gateway}_sys{instance}", service)
-
-			# Register on dbus, connect to localsettings
-			await asyncio.gather(leader.register(), leader.init())
-			leader.update_summaries()
-			self._leaders[instance].set_result(leader)
+			future = self._leaders[instance] = asyncio.Future()
+			try:
+				leader = await self._create_leader(service, instance)
+			except BaseException:
+				# Don't leave a pending future behind, units waiting
+				# for this leader get cancelled instead.
+				del self._leaders[instance]
+				self._members.pop(service, None)
+				future.cancel()
+				raise
+			future.set_result(leader)
+			if not self._registered:
+				self._registered = True
+				logger.info("First leader %s registered %.2fs after start",
+					leader.name, time.monotonic() - STARTED)
+
+	async def _create_leader(self, service, instance):
+		bus = await self._make_bus().connect()
+		gateway = service.gateway.replace(":", "_")
+		leader = Service(bus,
+			f"com.victronenergy.acsystem.{gateway}_sys{instance}", service)
+
+		# Register on dbus, connect to localsettings
+		try:
+			await asyncio.gather(leader.register(), leader.init(self))
+		except BaseException:
+			self.unroute_settings(leader)
+			await leader.close()
+			raise
+		leader.update_summaries()
+		return leader
+
+	async def _leave(self, service):
+		""" Remove service from the leader that owns it, and tear the leader
+		    down if it was the last unit. """
+		try:
+			instance = self._members.pop(service)
+		except KeyError:
+			return # Never joined a system
+
+		leader = await self._leaders[instance]
+		leader.remove_service(service)
+		if not leader.subservices:
+			if self.retention > 0:
+				# Keep the leader registered for a while, the unit might
+				# only be restarting.
+				leader.set_connected(0)
+				leader.invalidate()
+				self._expiry[instance] = asyncio.get_event_loop().call_later(
+					self.retention, self._drop_leader, instance)
+			else:
+				await self._drop_leader(instance)
+
+	def _drop_leader(self, instance):
+		""" Forget about a leader and close it. Returns the task doing the
+		    closing. """
+		self._expiry.pop(instance, None)
+		leader = self._leaders.pop(instance).result()
+		self.unroute_settings(leader)
+		task = asyncio.ensure_future(leader.close())
+		self._closing.add(task)
+		task.add_done_callback(self._closing.discard)
+		return task
 
 	async def serviceRemoved(self, service):
-		for leader in list(self.leaders):
-			leader.remove_service(service)
-			if not leader.subservices:
-				leader.__del__()
-				del self._leaders[leader.systeminstance]
+		await self._leave(service)
+		service.close()
 
 	async def systemInstanceChanged(self, service):
-		await self.serviceRemoved(service)
+		# Move the unit directly from its old leader to the new one. Only
+		# those two leaders are recomputed.
+		if self._members.get(service) == service.systeminstance:
+			return # Not actually moved
+		await self._leave(service)
 		await self.serviceAdded(service)
 
 	def itemsChanged(self, service, values):
@@ -459,122 +929,219 @@ class SystemMonitor(Monitor):
 		if '/N2kSystemInstance' in values.keys():
 			asyncio.create_task(self.systemInstanceChanged(service))
 			return
-		if (leader := self.get_leader(service.systeminstance)) is not None:
+		if (leader := self.get_leader(self._members.get(service))) is not None:
 			# Don't accept updates from services that are not part of the
 			# system yet.
 			if service not in leader.subservices:
 				return
+			leader.unit_changed(service, values)
+			fast = False
+			writes = defaultdict(dict)
 			for p, v in values.items():
 				if p in RsService.summaries:
-					leader.update_summary(p)
+					if self.lanes.is_fast(p):
+						leader.update_summary(p)
+					else:
+						leader.defer_summary(p)
 					continue
 
+				if self.lanes.triggers(p):
+					fast = True
+
 				if p not in self.synchronised_paths: continue
 				for s in leader.subservices:
 					if s is not service:
 						if s.get_value(p) != v:
-							s.set_value_async(p, v)
+							writes[s][p] = v
 				if leader.get_item(p).value != v:
 					with leader as s:
 						s[p] = v
 
+			for s, v in writes.items():
+				s.set_values_async(v)
+
+			if fast:
+				leader.schedule_fast_lane(self.lanes)
+
 	@property
 	def leaders(self):
 		return iter(s.result() for s in self._leaders.values() if s.done())
 
-async def calculation_loop(monitor):
+def aggregate(leader):
+	""" Sum power and current values over all units in the system. """
+	values = defaultdict(lambda: None)
+	for service in leader.subservices:
+		# DC values
+		values[p] = safe_max(values[p := "/Dc/0/Voltage"], service.voltage)
+		values[p] = safe_min(values[p := "/Soc"], service.soc)
+		values[p] = safe_add(values[p := "/Dc/0/Power"], service.power)
+		values[p] = safe_add(values[p := "/Dc/0/Current"], service.current)
+
+		for phase in range(1, 4):
+			for inp in range(1, 3):
+				a = f"/Ac/In/{inp}/P"
+				b = f"/Ac/In/{inp}/L{phase}/"
+				for p in (b + "P", b + "I"):
+					values[p] = safe_add(values[p], service.get_value(p))
+				p = b + "P"
+				values[a] = safe_add(values[a], service.get_value(p))
+
+				for p in (b + "V", b + "F"):
+					values[p] = safe_first(values[p], service.get_value(p))
+
+			b = f"/Ac/Out/L{phase}/"
+			for p in (b + "P", b + "I"):
+				values[p] = safe_add(values[p], service.get_value(p))
+				values["/Ac/Out/P"] = safe_add(values["/Ac/Out/P"],
+					service.get_value(p))
+
+			for p in (b + "V", b + "F"):
+				values[p] = safe_first(values[p], service.get_value(p))
+
+	# Number of inputs/phases
+	has_input1 = any(values[f"/Ac/In/1/L{x}/P"] is not None 
+		for x in range (1, 4))
+	has_input2 = any(values[f"/Ac/In/2/L{x}/P"] is not None 
+		for x in range (1, 4))
+	values["/Ac/NumberOfAcInputs"] = int(has_input1) + int (has_input2)
+
+	# Number of phases, we will use the outputs to detect that
+	values["/Ac/NumberOfPhases"] = sum(int(values[f"/Ac/Out/L{x}/P"] is not None) for x in range(1, 4))
+
+	# Determine the active input. This value is 0, 1 or 240. Until
+	# we get the Quattro-RS, 1 is not possible, so this is 0 or 240.
+	# To keep this simple, use the maximum number reported. If the
+	# value is invalid, assume it is disconnected. This is so that
+	# dbus-generator does not think there is a communication problem.
+	p = "/Ac/ActiveIn/ActiveInput"
+	try:
+		values[p] = max(s.get_value(p) for s in leader.subservices)
+	except (TypeError, ValueError):
+		values[p] = 0xF0 # disconnected
+
+	return values
+
+async def calculation_loop(monitor, throttle=None, interval=1):
+	throttle = Throttle() if throttle is None else throttle
+	loop = asyncio.get_event_loop()
 	while True:
+		due = throttle.due
 		for leader in monitor.leaders:
-			# Sum power and current values over all units in the system
-			values = defaultdict(lambda: None)
-			for service in leader.subservices:
-				# DC values
-				values[p] = safe_max(values[p := "/Dc/0/Voltage"], service.voltage)
-				values[p] = safe_min(values[p := "/Soc"], service.soc)
-				values[p] = safe_add(values[p := "/Dc/0/Power"], service.power)
-				values[p] = safe_add(values[p := "/Dc/0/Current"], service.current)
-
-				for phase in range(1, 4):
-					for inp in range(1, 3):
-						a = f"/Ac/In/{inp}/P"
-						b = f"/Ac/In/{inp}/L{phase}/"
-						for p in (b + "P", b + "I"):
-							values[p] = safe_add(values[p], service.get_value(p))
-						p = b + "P"
-						values[a] = safe_add(values[a], service.get_value(p))
-
-						for p in (b + "V", b + "F"):
-							values[p] = safe_first(values[p], service.get_value(p))
-
-					b = f"/Ac/Out/L{phase}/"
-					for p in (b + "P", b + "I"):
-						values[p] = safe_add(values[p], service.get_value(p))
-						values["/Ac/Out/P"] = safe_add(values["/Ac/Out/P"],
-							service.get_value(p))
-
-					for p in (b + "V", b + "F"):
-						values[p] = safe_first(values[p], service.get_value(p))
-
-			# Number of inputs/phases
-			has_input1 = any(values[f"/Ac/In/1/L{x}/P"] is not None 
-				for x in range (1, 4))
-			has_input2 = any(values[f"/Ac/In/2/L{x}/P"] is not None 
-				for x in range (1, 4))
-			values["/Ac/NumberOfAcInputs"] = int(has_input1) + int (has_input2)
-
-			# Number of phases, we will use the outputs to detect that
-			values["/Ac/NumberOfPhases"] = sum(int(values[f"/Ac/Out/L{x}/P"] is not None) for x in range(1, 4))
-
-			# Determine the active input. This value is 0, 1 or 240. Until
-			# we get the Quattro-RS, 1 is not possible, so this is 0 or 240.
-			# To keep this simple, use the maximum number reported. If the
-			# value is invalid, assume it is disconnected. This is so that
-			# dbus-generator does not think there is a communication problem.
-			p = "/Ac/ActiveIn/ActiveInput"
-			try:
-				values[p] = max(s.get_value(p) for s in leader.subservices)
-			except (TypeError, ValueError):
-				values[p] = 0xF0 # disconnected
-
+			leader.flush_summaries()
+			values = aggregate(leader)
 			with leader as s:
+				s["/Mgmt/ThrottleLevel"] = throttle.level
 				for p, v in values.items():
-					s[p] = v
+					if due or monitor.lanes.is_fast(p) or \
+							not throttle.is_informational(p):
+						s[p] = v
 
-		await asyncio.sleep(1)
+		# Measure how late we wake up, and how much is still waiting to be
+		# sent, to see if the bus or the process is congested.
+		wakeup = loop.time() + interval
+		await asyncio.sleep(interval)
+		throttle.update(loop.time() - wakeup, send_backlog(monitor.bus) +
+			sum(send_backlog(leader.bus) for leader in monitor.leaders))
 
-async def amain(bus_type):
+async def stream_loop(monitor, stream, interval=0.1):
+	""" Feed the binary stream, independent of the dbus publication rate
+	    so that fast readers do not add traffic on the bus. """
+	while True:
+		# Nobody reading, which is most of the time: skip the work
+		if stream.subscribers:
+			for leader in monitor.leaders:
+				values = aggregate(leader)
+				values.update(leader.summary_values())
+				stream.publish(leader.systeminstance, values)
+		await asyncio.sleep(interval)
+
+async def amain(bus_type, args):
 	bus = await MessageBus(bus_type=bus_type).connect()
 	monitor = await SystemMonitor.create(bus,
-		lambda: MessageBus(bus_type=bus_type))
+		lambda: MessageBus(bus_type=bus_type),
+		retention=args.leader_retention,
+		lanes=Lanes(args.fast_lane, args.fast_lane_interval))
 
 	# Fire off update threads
 	loop = asyncio.get_event_loop()
-	loop.create_task(calculation_loop(monitor))
+	loop.create_task(calculation_loop(monitor, interval=args.interval))
+
+	if args.stream_socket:
+		from stream import Stream
+		stream = Stream(args.stream_socket, stream_fields,
+			depth=args.stream_depth)
+		await stream.start()
+		loop.create_task(stream_loop(monitor, stream, args.stream_interval))
 
 	await bus.wait_for_disconnect()
 
 
+def new_event_loop(kind):
+	""" Create the main loop. uvloop is used if asked for and installed,
+	    otherwise the stock asyncio loop. """
+	if kind == 'uvloop':
+		try:
+			import uvloop
+		except ImportError:
+			logger.warning("uvloop is not installed, using asyncio")
+		else:
+			return uvloop.new_event_loop()
+	return asyncio.new_event_loop()
+
 def main():
 	parser = ArgumentParser(description=sys.argv[0])
 	parser.add_argument('--dbus', help='dbus bus to use, defaults to system',
 			default='system')
 	parser.add_argument('--debug', help='Turn on debug logging',
 			default=False, action='store_true')
+	parser.add_argument('--profile-dir',
+			help='Where to write reports when profiling is triggered with '
+			'SIGUSR1 (cProfile) or SIGUSR2 (tracemalloc)',
+			default='/tmp/dbus-acsystem')
+	parser.add_argument('--profile-window',
+			help='How many seconds a triggered profile runs, default 30',
+			type=int, default=30)
+	parser.add_argument('--leader-retention',
+			help='Seconds to keep a system registered after its last unit '
+			'disappeared, default 60', type=float, default=60)
+	parser.add_argument('--loop', help='Event loop to use, defaults to asyncio',
+			choices=('asyncio', 'uvloop'), default='asyncio')
+	parser.add_argument('--interval', help='Seconds between publications '
+			'of the slow lane, default 1', type=float, default=1)
+	parser.add_argument('--fast-lane', help='Path pattern to publish as '
+			'soon as an input changes, can be repeated. Defaults to '
+			+ ', '.join(Lanes.fast), action='append', metavar='PATTERN')
+	parser.add_argument('--fast-lane-interval', help='Minimum seconds '
+			'between fast lane publications of a system, changes in between '
+			'are merged, default 0.1', type=float, default=0.1)
+	parser.add_argument('--stream-socket', help='Unix socket to stream '
+			'aggregates on as binary frames, off by default', metavar='PATH')
+	parser.add_argument('--stream-interval', help='Seconds between stream '
+			'frames, default 0.1', type=float, default=0.1)
+	parser.add_argument('--stream-depth', help='Frames queued per stream '
+			'reader before the oldest are dropped, default 16', type=int,
+			default=16)
 	args = parser.parse_args()
 
 	logging.basicConfig(format='%(levelname)-8s %(message)s',
 			level=(logging.DEBUG if args.debug else logging.INFO))
+	for name, elapsed in timed_import.times:
+		logger.debug("Imported %-8s in %6.1f ms", name, elapsed * 1000)
 
 	bus_type = {
 		"system": BusType.SYSTEM,
 		"session": BusType.SESSION
 	}.get(args.dbus, BusType.SYSTEM)
 
-	mainloop = asyncio.new_event_loop()
+	mainloop = new_event_loop(args.loop)
 	asyncio.set_event_loop(mainloop)
+	logger.info("Using %s event loop with %s",
+		type(mainloop).__module__.split('.')[0],
+		MessageBus.__module__.split('.')[0])
+	Profiler(args.profile_dir, args.profile_window).install(mainloop)
 	logger.info("Starting main loop")
 	try:
-		asyncio.get_event_loop().run_until_complete(amain(bus_type))
+		asyncio.get_event_loop().run_until_complete(amain(bus_type, args))
 	except KeyboardInterrupt:
 		logger.info("Terminating")
 		pass
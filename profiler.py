@@ -0,0 +1,90 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Profiler(object):
+	""" On-demand diagnostics for a running service. SIGUSR1 runs cProfile
+	    for a bounded window, SIGUSR2 takes two tracemalloc snapshots a
+	    window apart and reports the difference. Nothing is imported or
+	    traced until a signal arrives, so this costs nothing while idle. """
+	def __init__(self, directory, window=30, top=40, frames=5):
+		self.directory = directory
+		self.window = window
+		self.top = top
+		self.frames = frames
+		self._loop = None
+		self._task = None
+
+	def install(self, loop):
+		self._loop = loop
+		loop.add_signal_handler(signal.SIGUSR1, self.trigger, self.profile)
+		loop.add_signal_handler(signal.SIGUSR2, self.trigger,
+			self.trace_allocations)
+
+	@property
+	def busy(self):
+		return self._task is not None and not self._task.done()
+
+	def trigger(self, job):
+		if self.busy:
+			logger.warning("Profiler already running, ignoring request")
+			return
+		self._task = self._loop.create_task(job())
+
+	def _report_path(self, kind):
+		os.makedirs(self.directory, exist_ok=True)
+		return os.path.join(self.directory, "{}-{}-{}.txt".format(
+			kind, os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+
+	async def profile(self):
+		""" Profile everything running on the loop for `window` seconds and
+		    write the top functions by cumulative time. """
+		import cProfile
+		import pstats
+
+		logger.info("Profiling for %d seconds", self.window)
+		profiler = cProfile.Profile()
+		profiler.enable()
+		try:
+			await asyncio.sleep(self.window)
+		finally:
+			profiler.disable()
+
+		path = self._report_path("cprofile")
+		with open(path, "w") as fp:
+			stats = pstats.Stats(profiler, stream=fp)
+			stats.sort_stats("cumulative").print_stats(self.top)
+		logger.info("Wrote profile to %s", path)
+		return path
+
+	async def trace_allocations(self):
+		""" Trace allocations for `window` seconds and write the lines
+		    whose memory use grew the most. """
+		import tracemalloc
+
+		logger.info("Tracing allocations for %d seconds", self.window)
+		tracemalloc.start(self.frames)
+		try:
+			before = tracemalloc.take_snapshot()
+			await asyncio.sleep(self.window)
+			after = tracemalloc.take_snapshot()
+			current, peak = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+
+		ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+		stats = after.filter_traces(ignore).compare_to(
+			before.filter_traces(ignore), "lineno")
+
+		path = self._report_path("tracemalloc")
+		with open(path, "w") as fp:
+			fp.write("Traced memory: current {} B, peak {} B\n".format(
+				current, peak))
+			for stat in stats[:self.top]:
+				fp.write("{}\n".format(stat))
+		logger.info("Wrote allocation report to %s", path)
+		return path
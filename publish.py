@@ -0,0 +1,103 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+def send_backlog(bus):
+	""" Number of messages queued on a bus but not yet written to the
+	    socket. This peeks at the writer of dbus_fast/dbus_next, for any
+	    other bus (or if that changes) it is 0. """
+	messages = getattr(getattr(bus, '_writer', None), 'messages', None)
+	try:
+		return len(messages)
+	except TypeError:
+		pass
+	try:
+		return messages.qsize()
+	except AttributeError:
+		return 0
+
+class Throttle(object):
+	""" Lowers the publication rate of informational aggregates while the
+	    process is falling behind. At level n these are only published
+	    every 2**n ticks, everything else is published every tick. The
+	    level goes up by one for every congested tick, and down by one
+	    after `recover` calm ticks in a row. """
+	informational = ("/V", "/F", "/Dc/0/Voltage", "/Soc")
+
+	def __init__(self, lag=0.25, backlog=100, max_level=3, recover=10):
+		self.lag = lag
+		self.backlog = backlog
+		self.max_level = max_level
+		self.recover = recover
+		self.level = 0
+		self._calm = 0
+		self._tick = 0
+
+	def update(self, lag, backlog):
+		""" Feed the event loop lag (seconds) and send backlog (messages)
+		    measured over the last tick. """
+		self._tick += 1
+		if lag > self.lag or backlog > self.backlog:
+			self._calm = 0
+			if self.level < self.max_level:
+				self.level += 1
+				logger.info("Congestion (lag %.3fs, backlog %d), "
+					"throttle level %d", lag, backlog, self.level)
+		elif self.level > 0:
+			self._calm += 1
+			if self._calm >= self.recover:
+				self._calm = 0
+				self.level -= 1
+				logger.info("Recovering, throttle level %d", self.level)
+
+	@property
+	def due(self):
+		""" True if informational paths should be published this tick. """
+		return self._tick % (1 << self.level) == 0
+
+	def is_informational(self, path):
+		return path.endswith(self.informational)
+
+class Lanes(object):
+	""" Splits the published paths in two lanes. Paths in the fast lane
+	    are recalculated and published as soon as a unit reports a change
+	    that feeds into them. Everything else is published in batches, on
+	    the calculation_loop cadence. In the patterns, * and ? match
+	    within one path element only, like in shell globs. A system
+	    publishes its fast lane at most once per `interval` seconds,
+	    changes that arrive in between go out together. """
+	fast = (
+		"/Ac/In/*/P",
+		"/Ac/ActiveIn/ActiveInput",
+		"/Alarms/*",
+		"/State",
+	)
+
+	def __init__(self, fast=None, interval=0.1):
+		self.patterns = self.fast if fast is None else tuple(fast)
+		self.interval = interval
+		self._match = re.compile("|".join(
+			_glob(p) for p in self.patterns)).fullmatch
+		self._fast = {}
+
+	def is_fast(self, path):
+		try:
+			return self._fast[path]
+		except KeyError:
+			pass
+		r = self._fast[path] = self._match(path) is not None
+		return r
+
+	def triggers(self, path):
+		""" True if a unit reporting a change on `path` affects a fast
+		    lane aggregate. Per-phase values feed the totals over all
+		    phases. """
+		return self.is_fast(path) or self.is_fast(
+			_phase_total.sub(r"\1\2", path))
+
+def _glob(pattern):
+	return "".join("[^/]+" if c == "*" else "[^/]" if c == "?" else
+		re.escape(c) for c in re.split(r"([*?])", pattern))
+
+_phase_total = re.compile(r"^(/Ac/(?:In/\d+|Out))/L\d(/[PI])$")
@@ -1,9 +1,26 @@
 import asyncio
+import logging
+
+try:
+	from dbus_fast import Message, MessageType
+except ImportError:
+	from dbus_next import Message, MessageType
+
 from aiovelib.client import Service as Client
 from aiovelib.client import Item as ClientItem
 from aiovelib.service import DoubleItem
 from summary import (SummaryAll, SummaryAny, SummaryFirst, SummaryMax,
-	SummaryMin, SummarySum, SummaryOptionalAlarm, SummaryDeviceState)
+	SummaryMin, SummarySum, SummaryOptionalAlarm, SummaryDeviceState,
+	settings_dependencies)
+from variant import wrap_dbus_value
+
+logger = logging.getLogger(__name__)
+
+# SetItems errors that mean a unit does not support it at all
+SETITEMS_UNSUPPORTED = frozenset((
+	"org.freedesktop.DBus.Error.UnknownMethod",
+	"org.freedesktop.DBus.Error.UnknownObject",
+	"org.freedesktop.DBus.Error.UnknownInterface"))
 
 class RsItem(ClientItem):
 	""" Subclass to allow us to wait for an item to turn valid. """
@@ -82,6 +99,9 @@ class RsService(Client):
 	for p, s in [("/Alarms/GridLost", "/Settings/Alarm/System/GridLost"),]:
 		summaries[p] = SummaryOptionalAlarm(s, p)
 
+	# Which summaries to recalculate when a setting changes
+	setting_dependencies = settings_dependencies(summaries)
+
 	paths = {
 		"/ProductId",
 		"/FirmwareVersion",
@@ -111,8 +131,72 @@ class RsService(Client):
 		"/Pv/L3/AcCoupledPower"
 	}.union(synchronised_paths).union(alarm_settings).union(summaries)
 
+	# Per-unit paths included in a leader snapshot
+	snapshot_paths = tuple(sorted(p for p in paths if p.startswith(
+		("/Ac/In/", "/Ac/Out/", "/Ac/ActiveIn/", "/Dc/0/", "/Soc", "/State"))))
+
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
+		self.setitems = None # Unknown until we try
+		self._writes = set()
+		self._serial = 0
+		self._written = {} # path -> serial of the last write
+
+	def set_value_async(self, path, value):
+		self._serial += 1
+		self._written[path] = self._serial
+		super().set_value_async(path, value)
+
+	def set_values_async(self, values):
+		""" Write several paths in one SetItems call. Firmware that does
+		    not support it gets one SetValue per path, the same as
+		    set_value_async. """
+		if len(values) > 1 and self.setitems is not False:
+			self._serial += 1
+			for p in values:
+				self._written[p] = self._serial
+			task = asyncio.create_task(self._set_items(values, self._serial))
+			self._writes.add(task)
+			task.add_done_callback(self._writes.discard)
+		else:
+			for p, v in values.items():
+				self.set_value_async(p, v)
+
+	async def _set_items(self, values, serial):
+		try:
+			reply = await self.monitor.bus.call(Message(
+				destination=self.name,
+				path="/",
+				interface="com.victronenergy.BusItem",
+				member="SetItems",
+				signature="a{sv}",
+				body=[{ p: wrap_dbus_value(v) for p, v in values.items() }]))
+		except Exception as e:
+			logger.warning("SetItems on %s failed: %s", self.name, e)
+			reply = None
+
+		if reply is not None and reply.message_type != MessageType.ERROR:
+			self.setitems = True
+			return
+
+		if reply is not None and reply.error_name in SETITEMS_UNSUPPORTED:
+			logger.info("%s does not support SetItems", self.name)
+			self.setitems = False
+
+		# Write the paths one by one, except those that were written again
+		# while this call was under way, which would now go back in time.
+		for p, v in values.items():
+			if self._written.get(p) == serial:
+				self.set_value_async(p, v)
+
+	def close(self):
+		""" Called when the unit disappears. Anything still waiting for its
+		    paths to turn valid, or for a write to go out, is cancelled. """
+		for item in self.values.values():
+			if not item._valid.done():
+				item._valid.cancel()
+		for task in list(self._writes):
+			task.cancel()
 
 	async def wait_for_valid(self, *paths):
 		# This will create the items (but mark them unseen) when you access
@@ -239,6 +323,13 @@ class RsService(Client):
 	def battery_discharge_setpoint(self, v):
 		self.set_value_async("/Ess/BatteryDischargeSetpoint", v)
 
+	@property
+	def dynamic_ess_support(self):
+		productid = self.productid or 0
+		firmwareversion = self.firmwareversion or 0
+		return ((0xA440 <= productid <= 0xA47F) and firmwareversion >= 0x11713) or \
+			((0xA480 <= productid <= 0xA4BF) and firmwareversion >= 0x10043) # Multi RS, HS-19
+
 	@property
 	def ac_connected(self):
 		return self.get_value("/Ac/ActiveIn/ActiveInput") != 0xF0
@@ -0,0 +1,154 @@
+import os
+import stat
+import time
+import math
+import struct
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ACSY"
+VERSION = 1
+
+# Record kinds
+LAYOUT = 0 # Payload is the utf-8 field names, separated by newlines
+FRAME = 1 # Payload is one little endian double per field, NaN if invalid
+
+# magic, version, kind, systeminstance, sequence, timestamp, payload length
+HEADER = struct.Struct("<4sBBHQdI")
+
+def pack_layout(fields):
+	payload = "\n".join(fields).encode("utf-8")
+	return HEADER.pack(MAGIC, VERSION, LAYOUT, 0, 0, 0.0,
+		len(payload)) + payload
+
+def unpack_header(data):
+	""" Returns (kind, systeminstance, sequence, timestamp, length). """
+	magic, version, *header = HEADER.unpack(data)
+	if magic != MAGIC or version != VERSION:
+		raise ValueError("Not a version {} acsystem stream".format(VERSION))
+	return header
+
+async def discard(reader, size=256):
+	""" Throw away whatever a reader sends, return when it hangs up. """
+	while await reader.read(size):
+		pass
+
+def as_double(v):
+	try:
+		return float(v)
+	except (TypeError, ValueError):
+		return math.nan
+
+class Subscriber(object):
+	""" One connected reader. Frames are queued up to `depth`, when a reader
+	    falls behind the oldest frames are dropped so that it never holds
+	    up the publisher or the other readers. """
+	def __init__(self, writer, depth):
+		self.writer = writer
+		self.queue = deque(maxlen=depth)
+		self.ready = asyncio.Event()
+		self.dropped = 0
+
+	def put(self, frame):
+		if len(self.queue) == self.queue.maxlen:
+			self.dropped += 1
+		self.queue.append(frame)
+		self.ready.set()
+
+	async def run(self):
+		while True:
+			await self.ready.wait()
+			self.ready.clear()
+			while self.queue:
+				self.writer.write(self.queue.popleft())
+			await self.writer.drain()
+
+class Stream(object):
+	""" Publishes aggregates as fixed-layout binary frames on a unix socket,
+	    so that local high-rate readers need not poll dbus. Every reader
+	    first gets a LAYOUT record naming the fields, then a FRAME per
+	    system per tick. Sequence numbers count per system, a gap means
+	    frames were dropped for that reader. """
+	def __init__(self, path, fields, depth=16):
+		self.path = path
+		self.fields = tuple(fields)
+		self.depth = depth
+		self.layout = pack_layout(self.fields)
+		self.frame = struct.Struct("<{}d".format(len(self.fields)))
+		self.subscribers = set()
+		self.sequence = {} # systeminstance -> last sequence number
+		self.server = None
+		self._tasks = set()
+
+	async def start(self):
+		# A socket left behind by an earlier run is ours to replace,
+		# anything else at the path is not.
+		try:
+			mode = os.lstat(self.path).st_mode
+		except FileNotFoundError:
+			pass
+		else:
+			if not stat.S_ISSOCK(mode):
+				raise FileExistsError("{} exists and is not a socket".format(
+					self.path))
+			os.unlink(self.path)
+		self.server = await asyncio.start_unix_server(self._connected,
+			path=self.path)
+		logger.info("Streaming %d fields on %s", len(self.fields), self.path)
+
+	async def close(self):
+		if self.server is not None:
+			self.server.close()
+		# Readers stay connected until told otherwise, drop them before
+		# waiting for the server to wind down.
+		for task in self._tasks:
+			task.cancel()
+		await asyncio.gather(*self._tasks, return_exceptions=True)
+		if self.server is not None:
+			await self.server.wait_closed()
+			self.server = None
+		try:
+			os.unlink(self.path)
+		except FileNotFoundError:
+			pass
+
+	async def _connected(self, reader, writer):
+		subscriber = Subscriber(writer, self.depth)
+		subscriber.put(self.layout)
+		self.subscribers.add(subscriber)
+		task = asyncio.current_task()
+		self._tasks.add(task)
+
+		# Readers only listen, so write until they hang up or the
+		# connection breaks.
+		pending = (asyncio.ensure_future(subscriber.run()),
+			asyncio.ensure_future(discard(reader)))
+		try:
+			await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+		except asyncio.CancelledError:
+			pass
+		finally:
+			for future in pending:
+				future.cancel()
+			await asyncio.gather(*pending, return_exceptions=True)
+			self._tasks.discard(task)
+			self.subscribers.discard(subscriber)
+			if subscriber.dropped:
+				logger.info("Stream reader left, %d frames dropped",
+					subscriber.dropped)
+			writer.close()
+
+	def publish(self, instance, values):
+		""" Queue a frame for every reader. `values` maps field names to
+		    values, missing and invalid fields are sent as NaN. """
+		if not self.subscribers:
+			return
+		sequence = self.sequence[instance] = self.sequence.get(instance, 0) + 1
+		frame = HEADER.pack(MAGIC, VERSION, FRAME, instance, sequence,
+			time.time(), self.frame.size) + self.frame.pack(
+				*(as_double(values.get(f)) for f in self.fields))
+		for subscriber in self.subscribers:
+			subscriber.put(frame)
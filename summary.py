@@ -26,6 +26,8 @@ N2K_CONVERTER_STATE_ASSISTING = 10
 #N2K_CONVERTER_STATE_EXTERNAL_CONTROL = 0xFC # bms or gx
 
 class Summary(object):
+	settings = () # localsettings paths this summary depends on
+
 	def __init__(self, path, item=None):
 		self.make_item = IntegerItem if item is None else item
 		self.path = path
@@ -82,6 +84,7 @@ class SettingMixin(object):
 	_default = None
 	def __init__(self, setting, path, item=None):
 		self.setting = setting
+		self.settings = (setting,)
 		super().__init__(path, item)
 
 	def summarise(self, leader):
@@ -95,12 +98,25 @@ class SettingMixin(object):
 class SummaryOptionalAlarm(SettingMixin, SummaryMax):
 	_default = 0
 
+def settings_dependencies(summaries):
+	""" Map each localsettings path to the summaries that must be
+	    recalculated when it changes. """
+	deps = {}
+	for summary in summaries.values():
+		for setting in summary.settings:
+			deps.setdefault(setting, []).append(summary.path)
+	return { k: tuple(v) for k, v in deps.items() }
+
 class SummaryDeviceState(Summary):
 	""" Sumarises the state of multiple RS units, so that the most relevant
 	    state is chosen. """
 	def summarise(self, leader):
 		states = set(x.get_value(self.path) for x in leader.subservices)
 
+		# A unit without a valid state says nothing about the others
+		if len(states) > 1:
+			states.discard(None)
+
 		# Just one state? Pass through.
 		if len(states) == 1:
 			return next(iter(states))
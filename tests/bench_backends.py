@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+""" Compare event loop and dbus library combinations on a simulated
+	multi-unit workload.
+
+	Not collected by pytest, run it by hand on the target:
+
+		python3 tests/bench_backends.py [--systems 4] [--units 3] [--ticks 500]
+
+	The traffic goes over a real bus: a private dbus-daemon is started for
+	the run, unless --address names one to use. Every tick, each unit sends
+	an ItemsChanged signal with new power values from its own connection.
+	The monitor connection receives them and feeds them to the leaders.
+	Each leader then sends its aggregated values as an ItemsChanged signal,
+	and the tick ends when the monitor connection has received those too.
+	Every combination of installed event loop (asyncio, uvloop) and dbus
+	library (dbus_fast, dbus_next) is measured.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import subprocess
+import importlib
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# helpers puts the bundled aiovelib on sys.path, import it first
+from helpers import (acsystem, MockSystemMonitor, FakeBus, make_bus,
+	build_unit_values)
+from aiovelib.test.localsettings import MockSettingsMonitor
+
+MATCH = "type='signal',interface='com.victronenergy.BusItem'," \
+	"member='ItemsChanged'"
+
+def wrap(Variant, v):
+	if v is None:
+		return Variant('ai', [])
+	if isinstance(v, float):
+		return Variant('d', v)
+	return Variant('i', int(v))
+
+def items_changed(library, values):
+	Variant = library.Variant
+	return library.Message.new_signal("/", "com.victronenergy.BusItem",
+		"ItemsChanged", "a{sa{sv}}", [{ p: { "Value": wrap(Variant, v),
+			"Text": Variant('s', str(v)) } for p, v in values.items() }])
+
+class Counter(object):
+	""" Resolves a future once `n` messages have been received. """
+	def __init__(self):
+		self.remaining = 0
+		self.done = None
+
+	def expect(self, n):
+		self.remaining = n
+		self.done = asyncio.get_event_loop().create_future()
+		return self.done
+
+	def hit(self):
+		self.remaining -= 1
+		if self.remaining == 0:
+			self.done.set_result(None)
+
+async def workload(library, address, systems, units, ticks):
+	MessageBus = library.aio.MessageBus
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+
+	listener = await MessageBus(bus_address=address).connect()
+	await listener.call(library.Message(destination="org.freedesktop.DBus",
+		path="/org/freedesktop/DBus", interface="org.freedesktop.DBus",
+		member="AddMatch", signature="s", body=[MATCH]))
+
+	fleet = []
+	units_by_name = {}
+	for instance in range(systems):
+		for unit in range(units):
+			name = f"com.victronenergy.multi.bench_{instance}_{unit}"
+			values = build_unit_values(instance=instance,
+				deviceinstance=256 + len(fleet))
+			values["/Devices/0/Nad"] = unit
+			service = await monitor.add_service(name, values)
+			bus = await MessageBus(bus_address=address).connect()
+			units_by_name[bus.unique_name] = service
+			fleet.append((bus, service))
+	leaders = [(leader, await MessageBus(bus_address=address).connect())
+		for leader in monitor.leaders]
+
+	counter = Counter()
+	def received(msg):
+		if msg.member != "ItemsChanged":
+			return
+		service = units_by_name.get(msg.sender)
+		if service is not None:
+			values = { p: v["Value"].value for p, v in msg.body[0].items() }
+			for p, v in values.items():
+				service.values[p].update(v)
+			monitor.itemsChanged(service, values)
+		counter.hit()
+	listener.add_message_handler(received)
+
+	start = time.perf_counter()
+	for tick in range(ticks):
+		done = counter.expect(len(fleet))
+		for n, (bus, service) in enumerate(fleet):
+			bus.send(items_changed(library, {
+				f"/Ac/Out/L{n % 3 + 1}/P": float(tick + n),
+				"/Dc/0/Power": float(tick - n) }))
+		await done
+
+		done = counter.expect(len(leaders))
+		for leader, bus in leaders:
+			values = acsystem.aggregate(leader)
+			with leader as s:
+				for p, v in values.items():
+					s[p] = v
+			bus.send(items_changed(library, values))
+		await done
+	elapsed = time.perf_counter() - start
+
+	for bus, _ in fleet:
+		bus.disconnect()
+	for _, bus in leaders:
+		bus.disconnect()
+	listener.disconnect()
+	return elapsed
+
+def loops():
+	yield 'asyncio', asyncio.new_event_loop
+	try:
+		import uvloop
+	except ImportError:
+		print("uvloop not installed, skipping")
+	else:
+		yield 'uvloop', uvloop.new_event_loop
+
+def libraries():
+	for name in ('dbus_fast', 'dbus_next'):
+		try:
+			library = importlib.import_module(name)
+			importlib.import_module(name + '.aio')
+		except ImportError:
+			print(f"{name} not installed, skipping")
+		else:
+			yield name, library
+
+def start_daemon():
+	""" Start a private dbus-daemon, returns the process and its address. """
+	daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork",
+		"--print-address=1"], stdout=subprocess.PIPE, text=True)
+	return daemon, daemon.stdout.readline().strip()
+
+def main():
+	parser = ArgumentParser(description=sys.argv[0])
+	parser.add_argument('--systems', type=int, default=4)
+	parser.add_argument('--units', type=int, default=3)
+	parser.add_argument('--ticks', type=int, default=500)
+	parser.add_argument('--address', help='dbus address to use, defaults '
+		'to a private dbus-daemon started for the run')
+	args = parser.parse_args()
+
+	acsystem.SettingsMonitor = MockSettingsMonitor
+	daemon, address = (None, args.address) if args.address else \
+		start_daemon()
+	try:
+		backends = list(libraries())
+		for lname, factory in loops():
+			for bname, library in backends:
+				loop = factory()
+				try:
+					elapsed = loop.run_until_complete(workload(library,
+						address, args.systems, args.units, args.ticks))
+				finally:
+					loop.close()
+				print("{:8} {:10} {:8.3f} s {:8.1f} us/tick".format(lname,
+					bname, elapsed, elapsed * 1e6 / args.ticks))
+	finally:
+		if daemon is not None:
+			daemon.terminate()
+			daemon.wait()
+
+if __name__ == "__main__":
+	main()
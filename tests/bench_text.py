@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+""" Compare eager and lazy text formatting of the measurement items.
+
+	Not collected by pytest, run it by hand on the target:
+
+		python3 tests/bench_text.py [--changes 20000] [--reads 2]
+
+	Every change sets a new value on each measurement path of a leader, the
+	text of each path is then asked for `--reads` times, as publication and
+	GetItems/GetText would. DoubleItem is what the leader used before,
+	LazyDoubleItem is what it uses now. The report is the time per change
+	of one path, the best of five runs.
+"""
+
+import os
+import sys
+import timeit
+import asyncio
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# helpers puts the bundled aiovelib on sys.path, import it first
+from helpers import acsystem, MockSystemMonitor, FakeBus, make_bus, \
+	build_unit_values
+from aiovelib.test.localsettings import MockSettingsMonitor
+
+async def make_leader():
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	await monitor.add_service("com.victronenergy.multi.bench",
+		build_unit_values(instance=1))
+	return monitor.get_leader(1)
+
+def run(leader, paths, changes, reads):
+	items = [leader.get_item(p) for p in paths]
+	for n in range(changes):
+		with leader as s:
+			for p in paths:
+				s[p] = n * 0.37
+		for item in items:
+			for _ in range(reads):
+				item.get_text()
+
+def main():
+	parser = ArgumentParser(description=sys.argv[0])
+	parser.add_argument('--changes', type=int, default=20000)
+	parser.add_argument('--reads', type=int, default=2)
+	args = parser.parse_args()
+
+	acsystem.SettingsMonitor = MockSettingsMonitor
+	leader = asyncio.new_event_loop().run_until_complete(make_leader())
+	specs = [spec for spec in acsystem.LEADER_SCHEMA
+		if spec.item is acsystem.LazyDoubleItem]
+
+	for name, item in (('eager', acsystem.DoubleItem),
+			('lazy', acsystem.LazyDoubleItem)):
+		paths = []
+		for spec in specs:
+			path = f"/Bench/{name}{spec.path}"
+			leader.add_item(item(path, None, text=spec.text))
+			paths.append(path)
+		elapsed = min(timeit.repeat(lambda: run(leader, paths, args.changes,
+			args.reads), number=1, repeat=5))
+		print("{:6} {:8.3f} s {:8.2f} us/change".format(name, elapsed,
+			elapsed * 1e6 / (args.changes * len(paths))))
+
+if __name__ == "__main__":
+	main()
@@ -4,6 +4,11 @@
 
 from conftest import load_acsystem
 
+try:
+	from dbus_fast import Message
+except ImportError:
+	from dbus_next import Message
+
 from aiovelib.test.client import MockMonitor
 from aiovelib.test.localsettings import MockSettingsMonitor
 
@@ -30,6 +35,14 @@ class FakeBus:
 	def send(self, msg):
 		pass
 
+	async def call(self, msg):
+		# Like a unit without SetItems support, callers fall back
+		return Message.new_error(msg,
+			"org.freedesktop.DBus.Error.UnknownMethod", "Unknown method")
+
+	def disconnect(self):
+		pass
+
 	async def connect(self):
 		return self
 
@@ -48,8 +61,8 @@ class MockSystemMonitor(MockMonitor, acsystem.SystemMonitor):
 
 
 def patch_settings(monkeypatch):
-	""" Make the leader's wait_for_settings() use the in-memory localsettings
-	    double instead of a real SettingsMonitor. """
+	""" Make the shared localsettings client (SystemMonitor.wait_for_settings)
+	    use the in-memory double instead of a real SettingsMonitor. """
 	monkeypatch.setattr(acsystem, "SettingsMonitor", MockSettingsMonitor)
 
 
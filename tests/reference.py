@@ -0,0 +1,154 @@
+""" Reference implementation of the acsystem aggregation, frozen from
+	dbus-acsystem 0.45. Do not optimise or "fix" anything in here: it is
+	the oracle that faster engines are compared against in test_oracle.py.
+	If the intended behaviour changes, change it here on purpose, in the
+	same commit.
+
+	Everything works on a list of units, using only get_value(), and on a
+	settings getter for the setting-dependent summaries. """
+
+from collections import defaultdict
+
+
+def safe_add(*args):
+	args = [x for x in args if x is not None]
+	return sum(args) if args else None
+
+def safe_max(*args):
+	args = [x for x in args if x is not None]
+	return max(args) if args else None
+
+def safe_min(*args):
+	args = [x for x in args if x is not None]
+	return min(args) if args else None
+
+def safe_first(*args):
+	for a in args:
+		if a is not None:
+			return a
+	return None
+
+
+def aggregate(units):
+	""" The body of calculation_loop for one leader. """
+	values = defaultdict(lambda: None)
+	for service in units:
+		# DC values
+		values[p] = safe_max(values[p := "/Dc/0/Voltage"], service.get_value(p))
+		values[p] = safe_min(values[p := "/Soc"], service.get_value(p))
+		values[p] = safe_add(values[p := "/Dc/0/Power"], service.get_value(p))
+		values[p] = safe_add(values[p := "/Dc/0/Current"], service.get_value(p))
+
+		for phase in range(1, 4):
+			for inp in range(1, 3):
+				a = f"/Ac/In/{inp}/P"
+				b = f"/Ac/In/{inp}/L{phase}/"
+				for p in (b + "P", b + "I"):
+					values[p] = safe_add(values[p], service.get_value(p))
+				p = b + "P"
+				values[a] = safe_add(values[a], service.get_value(p))
+
+				for p in (b + "V", b + "F"):
+					values[p] = safe_first(values[p], service.get_value(p))
+
+			b = f"/Ac/Out/L{phase}/"
+			for p in (b + "P", b + "I"):
+				values[p] = safe_add(values[p], service.get_value(p))
+				values["/Ac/Out/P"] = safe_add(values["/Ac/Out/P"],
+					service.get_value(p))
+
+			for p in (b + "V", b + "F"):
+				values[p] = safe_first(values[p], service.get_value(p))
+
+	has_input1 = any(values[f"/Ac/In/1/L{x}/P"] is not None
+		for x in range (1, 4))
+	has_input2 = any(values[f"/Ac/In/2/L{x}/P"] is not None
+		for x in range (1, 4))
+	values["/Ac/NumberOfAcInputs"] = int(has_input1) + int (has_input2)
+	values["/Ac/NumberOfPhases"] = sum(int(values[f"/Ac/Out/L{x}/P"] is not None) for x in range(1, 4))
+
+	p = "/Ac/ActiveIn/ActiveInput"
+	try:
+		values[p] = max(s.get_value(p) for s in units)
+	except (TypeError, ValueError):
+		values[p] = 0xF0 # disconnected
+
+	return dict(values)
+
+
+def total_setpoint(units):
+	""" Service._get_total_setpoint """
+	connected = [s for s in units
+		if s.get_value("/Ac/ActiveIn/ActiveInput") != 0xF0]
+	try:
+		return int(sum(s.get_value("/Ess/AcPowerSetpoint") for s in connected
+			if s.get_value("/Ess/AcPowerSetpoint") is not None))
+	except TypeError:
+		pass
+	return None
+
+
+def summary_all(units, path, setting):
+	return int(all(x.get_value(path) for x in units))
+
+def summary_any(units, path, setting):
+	return int(any(x.get_value(path) for x in units))
+
+def summary_max(units, path, setting):
+	try:
+		return max(y for y in (x.get_value(path) for x in units) if y is not None)
+	except ValueError:
+		return None
+
+def summary_min(units, path, setting):
+	try:
+		return min(y for y in (x.get_value(path) for x in units) if y is not None)
+	except ValueError:
+		return None
+
+def summary_first(units, path, setting):
+	for x in units:
+		return x.get_value(path)
+	return None
+
+def summary_sum(units, path, setting):
+	v = [y for y in (x.get_value(path) for x in units) if y is not None]
+	return sum(v) if v else None
+
+def summary_optional_alarm(units, path, setting):
+	if setting("/Settings/Alarm/System/GridLost") == 1:
+		return summary_max(units, path, setting)
+	return 0
+
+def summary_device_state(units, path, setting):
+	states = set(x.get_value(path) for x in units)
+	if len(states) > 1:
+		states.discard(None) # Changed on purpose, None and ints crashed min()
+	if len(states) == 1:
+		return next(iter(states))
+	for s in (2, 0xFA, 9, 8, 10): # fault, blocked, inverting, passthru, assisting
+		if s in states:
+			return s
+	try:
+		return min(iter(states))
+	except ValueError:
+		return None
+
+
+summaries = {
+	"/Capabilities/HasAcPassthroughSupport": summary_all,
+	"/Ac/In/1/CurrentLimitIsAdjustable": summary_all,
+	"/Ac/In/2/CurrentLimitIsAdjustable": summary_all,
+	"/Ess/Sustain": summary_any,
+	"/Alarms/PhaseRotation": summary_max,
+	"/Alarms/HighTemperature": summary_max,
+	"/Alarms/Overload": summary_max,
+	"/Ac/NoFeedInReason": summary_min,
+	"/Ess/ActiveSocLimit": summary_first,
+	"/Ac/Out/L1/NominalInverterPower": summary_sum,
+	"/Ac/Out/L2/NominalInverterPower": summary_sum,
+	"/Ac/Out/L3/NominalInverterPower": summary_sum,
+	"/Ess/BatteryDischargeCapacity": summary_sum,
+	"/State": summary_device_state,
+	"/Alarms/GridLost": summary_optional_alarm,
+}
@@ -0,0 +1,122 @@
+""" Deterministic long-horizon simulation for the acsystem tests.
+
+	VirtualClockLoop is an asyncio loop whose clock only moves when it has
+	nothing else to do: instead of sleeping until the next timer is due, it
+	jumps ahead to it. calculation_loop and any asyncio.sleep() run as
+	usual, a day of ticks just doesn't take a day.
+
+	Scenario scripts what happens to a fleet of units, at virtual times:
+
+		scenario = Scenario()
+		scenario.join(0, "a", build_unit_values(instance=1))
+		scenario.ramp(0, 3600, "a", "/Ac/Out/L1/P", 0, 3000, step=60)
+		scenario.leave(1800, "a")
+		scenario.call(3600, lambda monitor: ...)
+		VirtualClockLoop().run_until_complete(scenario.run(monitor, 7200))
+"""
+
+import asyncio
+import selectors
+from functools import partial
+
+from helpers import acsystem
+
+SERVICE_PREFIX = "com.victronenergy.multi.sim_"
+
+
+class VirtualSelector(selectors.DefaultSelector):
+	""" Never blocks, advances the loop's clock by the timeout instead. """
+	def __init__(self, loop):
+		super().__init__()
+		self.loop = loop
+
+	def select(self, timeout=None):
+		if timeout is None:
+			raise RuntimeError("Nothing scheduled, the simulation would hang")
+		if timeout > 0:
+			self.loop.advance(timeout)
+		return super().select(0)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+	def __init__(self):
+		self._now = 0.0
+		super().__init__(VirtualSelector(self))
+
+	def time(self):
+		return self._now
+
+	def advance(self, seconds):
+		self._now += seconds
+
+
+class Scenario(object):
+	""" A list of events (joins, leaves, instance changes, value changes),
+	    each at a virtual time in seconds from the start of the run. """
+	def __init__(self):
+		self.events = []
+		self.units = {}
+
+	def _add(self, t, action):
+		self.events.append((t, len(self.events), action))
+		return self
+
+	def join(self, t, name, values):
+		return self._add(t, partial(self._join, name, dict(values)))
+
+	def leave(self, t, name):
+		return self._add(t, partial(self._leave, name))
+
+	def move(self, t, name, instance):
+		return self.set(t, name, { "/N2kSystemInstance": instance })
+
+	def set(self, t, name, values):
+		return self._add(t, partial(self._set, name, dict(values)))
+
+	def ramp(self, start, end, name, path, first, last, step=1):
+		""" Change `path` linearly from `first` to `last` between the times
+		    `start` and `end`, one update every `step` seconds. """
+		steps = max(1, int((end - start) / step))
+		for i in range(steps + 1):
+			self.set(start + i * step, name,
+				{ path: first + (last - first) * i / steps })
+		return self
+
+	def call(self, t, fn):
+		""" Call fn(monitor) at time t, for probes and assertions. """
+		return self._add(t, partial(self._call, fn))
+
+	async def _join(self, name, values, monitor):
+		self.units[name] = await monitor.add_service(
+			SERVICE_PREFIX + name, values)
+
+	async def _leave(self, name, monitor):
+		await monitor.serviceRemoved(self.units.pop(name))
+
+	async def _set(self, name, values, monitor):
+		service = self.units[name]
+		for p, v in values.items():
+			service.values[p].update(v)
+		monitor.itemsChanged(service, values)
+
+	async def _call(self, fn, monitor):
+		fn(monitor)
+
+	async def run(self, monitor, until, interval=1):
+		""" Run calculation_loop and play the events, until virtual time
+		    `until`. """
+		loop = asyncio.get_event_loop()
+		start = loop.time()
+		ticker = loop.create_task(acsystem.calculation_loop(monitor,
+			interval=interval))
+		try:
+			for t, _, action in sorted(self.events):
+				await asyncio.sleep(max(0, start + t - loop.time()))
+				await action(monitor)
+			await asyncio.sleep(max(0, start + until - loop.time()))
+		finally:
+			ticker.cancel()
+			try:
+				await ticker
+			except asyncio.CancelledError:
+				pass
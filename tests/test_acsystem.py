@@ -2,8 +2,22 @@
 	unit appearing should create a leader and publish a new
 	com.victronenergy.acsystem.* service. """
 
+import asyncio
+from types import SimpleNamespace
+
+try:
+	from dbus_fast import MessageType
+except ImportError:
+	from dbus_next import MessageType
+
+from aiovelib.test.localsettings import MockSettingsMonitor
+
+from publish import Lanes
+from rsservice import RsService
+
 from helpers import (
-	MockSystemMonitor, make_bus, patch_settings, build_unit_values, FakeBus)
+	MockSystemMonitor, make_bus, patch_settings, build_unit_values, FakeBus,
+	acsystem)
 
 MULTI = "com.victronenergy.multi.test"
 
@@ -31,3 +45,417 @@ async def test_acsystem_service_customname(monkeypatch):
 	# init() resolved the in-memory localsettings double and applied the
 	# default (empty) CustomName, falling back to the generated name.
 	assert leader.customname == "AC system (1)"
+
+
+async def test_instance_change_migrates_unit(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	a = await monitor.add_service(MULTI + "a",
+		build_unit_values(instance=1, deviceinstance=256))
+	b = await monitor.add_service(MULTI + "b",
+		build_unit_values(instance=1, deviceinstance=257))
+
+	b.values["/N2kSystemInstance"].update(2)
+	await monitor.systemInstanceChanged(b)
+
+	assert monitor.get_leader(1).subservices == { a }
+	assert monitor.get_leader(2).subservices == { b }
+
+	await monitor.serviceRemoved(b)
+	assert monitor.get_leader(2) is None
+	assert monitor.get_leader(1).subservices == { a }
+
+
+async def test_empty_leader_is_retained(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus,
+		retention=60)
+	values = build_unit_values(instance=1)
+	values.update({ "/Ac/Out/L1/P": 800.0, "/Dc/0/Voltage": 52.0 })
+	rs = await monitor.add_service(MULTI, values)
+	leader = monitor.get_leader(1)
+	with leader as s: # One calculation_loop tick
+		for p, v in acsystem.aggregate(leader).items():
+			s[p] = v
+	assert leader.get_item("/Ac/Out/P").value == 800.0
+
+	await monitor.serviceRemoved(rs)
+	assert monitor.get_leader(1) is leader
+	assert leader.get_item("/Connected").value == 0
+	# Nothing left to measure, don't keep publishing stale values
+	for p in ("/Ac/Out/P", "/Ac/Out/L1/P", "/Dc/0/Voltage"):
+		assert leader.get_item(p).value is None
+
+	await monitor.serviceAdded(rs)
+	assert monitor.get_leader(1) is leader
+	assert leader.get_item("/Connected").value == 1
+	assert rs in leader.subservices
+
+
+async def test_only_dependent_summaries_follow_settings(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	await monitor.add_service(MULTI, build_unit_values(instance=1))
+	leader = monitor.get_leader(1)
+
+	updated = []
+	monkeypatch.setattr(leader, "update_summary", updated.append)
+	monkeypatch.setattr(leader, "update_summaries",
+		lambda: updated.append("all"))
+
+	monitor.settingsChanged(None, {"/Settings/Gui/Brightness": 5})
+	assert updated == []
+
+	monitor.settingsChanged(None, {"/Settings/Alarm/System/GridLost": 1})
+	assert updated == ["/Alarms/GridLost"]
+
+
+async def test_leaders_share_settings_client(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	await monitor.add_service(MULTI + "a", build_unit_values(instance=1))
+	await monitor.add_service(MULTI + "b", build_unit_values(instance=2))
+	one, two = monitor.get_leader(1), monitor.get_leader(2)
+	assert one.settings is two.settings
+
+	monitor.settingsChanged(None,
+		{"/Settings/AcSystem/2/CustomName": "Barn"})
+	assert one.customname == "AC system (1)"
+	assert two.customname == "Barn"
+
+
+async def test_settings_monitor_reused_after_timeout(monkeypatch):
+	patch_settings(monkeypatch)
+
+	created = []
+	class FlakySettingsMonitor(MockSettingsMonitor):
+		""" localsettings does not show up the first time. """
+		def __init__(self, *args, **kwargs):
+			super().__init__(*args, **kwargs)
+			created.append(self)
+
+		async def wait_for_service(self, name):
+			if len(created) == 1 and not hasattr(self, "retried"):
+				self.retried = True
+				raise asyncio.TimeoutError()
+			return await super().wait_for_service(name)
+	monkeypatch.setattr(acsystem, "SettingsMonitor", FlakySettingsMonitor)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	try:
+		await monitor.wait_for_settings()
+	except asyncio.TimeoutError:
+		pass
+	settings = await monitor.wait_for_settings()
+
+	assert len(created) == 1
+	assert settings is not None
+
+
+async def test_measurement_text_formatted_once_per_value(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	await monitor.add_service(MULTI, build_unit_values(instance=1))
+	leader = monitor.get_leader(1)
+	item = leader.get_item("/Ac/Out/P")
+	assert isinstance(item, acsystem.LazyDoubleItem)
+
+	formatted = []
+	format_text = item.format_text
+	item.format_text = lambda v: formatted.append(v) or format_text(v)
+	for v in (1234.4, 1500.0):
+		with leader as s:
+			s["/Ac/Out/P"] = v
+		assert item.get_text() == item.get_text() == f"{v:.0f} W"
+	assert formatted == [1234.4, 1500.0]
+
+	with leader as s:
+		s["/Ac/Out/P"] = None
+	item.get_text()
+	assert formatted == [1234.4, 1500.0]
+
+async def test_snapshot_returns_deltas(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	rs = await monitor.add_service(MULTI, build_unit_values(instance=1))
+	leader = monitor.get_leader(1)
+
+	generation, values, units = leader.snapshot()
+	assert values["/CustomName"] == "AC system (1)"
+	assert units[MULTI]["/State"] == 9
+
+	# Nothing changed, nothing returned
+	assert leader.snapshot(generation) == (generation, {}, {})
+
+	rs.values["/State"].update(10)
+	leader.update_summary("/State")
+	later, values, units = leader.snapshot(generation)
+	assert later == generation + 1
+	assert values == { "/State": 10 }
+	assert units == { MULTI: { "/State": 10 } }
+
+	values = build_unit_values(instance=1, deviceinstance=257)
+	values["/Devices/0/Nad"] = 1
+	await monitor.add_service(MULTI + "b", values)
+	later, _, _ = leader.snapshot(later)
+
+	await monitor.serviceRemoved(rs)
+	_, values, units = leader.snapshot(later)
+	assert units == { MULTI: {} }
+	assert values["/Devices/0/Service"] is None
+
+
+async def test_fast_lane_published_on_change(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	rs = await monitor.add_service(MULTI, build_unit_values(instance=1))
+	leader = monitor.get_leader(1)
+
+	values = { "/Ac/In/1/L1/P": 1200.0, "/Ac/Out/L1/V": 230.0, "/State": 10 }
+	for p, v in values.items():
+		rs.values[p].update(v)
+	monitor.itemsChanged(rs, values)
+	await asyncio.sleep(0)
+
+	# Fast lane right away, slow lane on the next tick
+	assert leader.get_item("/Ac/In/1/P").value == 1200.0
+	assert leader.get_item("/State").value == 10
+	assert leader.get_item("/Ac/Out/L1/V").value is None
+	assert leader.get_item("/Ac/In/1/L1/P").value is None # Per phase is slow
+
+
+async def test_fast_lane_merges_changes_within_interval(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus,
+		lanes=Lanes(interval=0.2))
+	a = await monitor.add_service(MULTI + "a", build_unit_values(instance=1))
+	b = await monitor.add_service(MULTI + "b",
+		build_unit_values(instance=1, deviceinstance=257))
+	leader = monitor.get_leader(1)
+
+	publishes = []
+	publish = leader._publish_fast_lane
+	monkeypatch.setattr(leader, "_publish_fast_lane",
+		lambda lanes: publishes.append(lanes) or publish(lanes))
+
+	def report(unit, p, v):
+		unit.values[p].update(v)
+		monitor.itemsChanged(unit, { p: v })
+
+	# The first change after a quiet spell goes out right away
+	report(a, "/Ac/In/1/L1/P", 1000.0)
+	await asyncio.sleep(0)
+	assert len(publishes) == 1
+	assert leader.get_item("/Ac/In/1/P").value == 1000.0
+
+	# The units keep reporting, at different times, within the interval
+	await asyncio.sleep(0.05)
+	report(b, "/Ac/In/1/L1/P", 500.0)
+	await asyncio.sleep(0.05)
+	report(a, "/Ac/In/1/L1/P", 1200.0)
+	await asyncio.sleep(0)
+	assert len(publishes) == 1
+	assert leader.get_item("/Ac/In/1/P").value == 1000.0
+
+	# ... and go out together once it is over
+	await asyncio.sleep(0.15)
+	assert len(publishes) == 2
+	assert leader.get_item("/Ac/In/1/P").value == 1700.0
+
+async def test_fast_lane_cancelled_on_close(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	rs = await monitor.add_service(MULTI, build_unit_values(instance=1))
+	leader = monitor.get_leader(1)
+
+	rs.values["/Ac/In/1/L1/P"].update(1200.0)
+	monitor.itemsChanged(rs, { "/Ac/In/1/L1/P": 1200.0 })
+	pending = leader._fast_lane
+	await leader.close()
+	await asyncio.sleep(0)
+
+	assert pending.cancelled()
+	assert leader.get_item("/Ac/In/1/P").value is None
+
+
+class SetItemsBus(FakeBus):
+	""" A bus on which every unit supports SetItems. """
+	def __init__(self):
+		self.calls = []
+
+	async def call(self, msg):
+		self.calls.append(msg)
+		return SimpleNamespace(message_type=MessageType.METHOD_RETURN)
+
+
+async def test_joining_unit_synchronised_in_one_call(monkeypatch):
+	patch_settings(monkeypatch)
+
+	bus = SetItemsBus()
+	monitor = await MockSystemMonitor.create(bus, make_bus)
+	await monitor.add_service(MULTI + "a", build_unit_values(instance=1))
+
+	values = build_unit_values(instance=1, deviceinstance=257)
+	values.update({ "/Ac/In/1/CurrentLimit": 10.0,
+		"/Settings/Ess/MinimumSocLimit": 50.0, "/Ac/In/1/Type": 3 })
+	b = await monitor.add_service(MULTI + "b", values)
+	await asyncio.sleep(0)
+
+	assert len(bus.calls) == 1
+	assert bus.calls[0].destination == b.name
+	assert bus.calls[0].member == "SetItems"
+	assert set(bus.calls[0].body[0]) == { "/Ac/In/1/CurrentLimit",
+		"/Settings/Ess/MinimumSocLimit", "/Ac/In/1/Type" }
+	assert b.setitems is True
+
+
+def spy_writes(monkeypatch):
+	""" Record the paths written one by one, in order. """
+	writes = []
+	set_value_async = RsService.set_value_async
+	def spy(self, path, value):
+		writes.append((path, value))
+		set_value_async(self, path, value)
+	monkeypatch.setattr(RsService, "set_value_async", spy)
+	return writes
+
+
+class SlowBus(FakeBus):
+	""" Holds SetItems calls until released, then answers with `error`, or
+	    raises it if it is an exception. """
+	def __init__(self, error):
+		self.error = error
+		self.release = asyncio.Event()
+
+	async def call(self, msg):
+		await self.release.wait()
+		if isinstance(self.error, Exception):
+			raise self.error
+		return SimpleNamespace(message_type=MessageType.ERROR,
+			error_name=self.error)
+
+
+async def test_setitems_fallback_keeps_newer_writes(monkeypatch):
+	patch_settings(monkeypatch)
+
+	bus = SlowBus("org.freedesktop.DBus.Error.UnknownObject")
+	monitor = await MockSystemMonitor.create(bus, make_bus)
+	rs = await monitor.add_service(MULTI, build_unit_values(instance=1))
+	writes = spy_writes(monkeypatch)
+
+	rs.set_values_async({ "/Mode": 1, "/Ac/In/1/CurrentLimit": 10.0 })
+	await asyncio.sleep(0)
+	rs.set_value_async("/Mode", 4) # Newer, while SetItems is under way
+	bus.release.set()
+	await asyncio.sleep(0)
+
+	assert writes == [("/Mode", 4), ("/Ac/In/1/CurrentLimit", 10.0)]
+	assert rs.setitems is False
+
+
+async def test_setitems_failure_falls_back(monkeypatch):
+	patch_settings(monkeypatch)
+
+	bus = SlowBus(ConnectionError("disconnected"))
+	bus.release.set()
+	monitor = await MockSystemMonitor.create(bus, make_bus)
+	rs = await monitor.add_service(MULTI, build_unit_values(instance=1))
+	writes = spy_writes(monkeypatch)
+
+	rs.set_values_async({ "/Mode": 1, "/Ac/In/1/CurrentLimit": 10.0 })
+	await asyncio.sleep(0)
+
+	assert writes == [("/Mode", 1), ("/Ac/In/1/CurrentLimit", 10.0)]
+	assert rs.setitems is None # Not known to be unsupported, try again
+
+
+async def test_routing_indexes_follow_unit_changes(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	a = await monitor.add_service(MULTI + "a", build_unit_values(instance=1))
+	values = build_unit_values(instance=1, deviceinstance=257)
+	values["/FirmwareVersion"] = 0x11000 # Too old for DynamicEss
+	b = await monitor.add_service(MULTI + "b", values)
+	leader = monitor.get_leader(1)
+
+	assert leader.connected == { a, b }
+	assert leader.dynamic_ess == { a }
+	assert leader.get_item("/Capabilities/HasDynamicEssSupport").value == 0
+
+	changes = { "/Ac/ActiveIn/ActiveInput": 0xF0, "/FirmwareVersion": 0x11713,
+		"/Pv/L2/AcCoupledPower": 300.0 }
+	for p, v in changes.items():
+		b.values[p].update(v)
+	monitor.itemsChanged(b, changes)
+
+	assert leader.connected == { a }
+	assert leader.ac_coupled == { 1: set(), 2: { b }, 3: set() }
+	assert leader.get_item("/Capabilities/HasDynamicEssSupport").value == 1
+	assert leader._get_ac_coupled_power(2) == 300.0
+
+
+async def test_invalid_unit_state_is_ignored(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	a = await monitor.add_service(MULTI + "a", build_unit_values(instance=1))
+	values = build_unit_values(instance=1, deviceinstance=257)
+	values["/State"] = 3 # Bulk
+	b = await monitor.add_service(MULTI + "b", values)
+	leader = monitor.get_leader(1)
+
+	a.values["/State"].update(None)
+	monitor.itemsChanged(a, { "/State": None })
+	assert leader.get_item("/State").value == 3
+
+	b.values["/State"].update(None)
+	monitor.itemsChanged(b, { "/State": None })
+	assert leader.get_item("/State").value is None
+
+async def test_leader_built_from_schema(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	await monitor.add_service(MULTI, build_unit_values(instance=1))
+	leader = monitor.get_leader(1)
+
+	schema = [spec.path for spec in acsystem.LEADER_SCHEMA]
+	assert len(schema) == len(set(schema))
+	assert set(leader.paths) == set(schema) | {
+		"/Devices/0/Service", "/Devices/0/Instance" }
+	assert leader.get_item("/Ac/In/1/CurrentLimit").value == 16.0
+	assert leader.get_item("/DeviceInstance").value == 1
+
+
+async def test_leader_close_unexports_once_without_publishing(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	await monitor.add_service(MULTI, build_unit_values(instance=1))
+	leader = monitor.get_leader(1)
+
+	unexported = []
+	monkeypatch.setattr(acsystem._Service, "__del__",
+		lambda self: unexported.append(self))
+	published = []
+	monkeypatch.setattr(leader, "update_summaries",
+		lambda: published.append("summaries"))
+	monkeypatch.setattr(leader, "update_capabilities",
+		lambda: published.append("capabilities"))
+
+	await leader.close()
+	leader.__del__() # As the garbage collector would
+
+	assert unexported == [leader]
+	assert published == []
+	assert not leader.subservices and not leader.connected
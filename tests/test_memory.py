@@ -0,0 +1,102 @@
+""" Memory budgets for the objects dbus-acsystem keeps per system and per
+	unit. GX devices are short on RAM, so a change that makes a leader or a
+	unit noticeably more expensive (eg. by adding a lot of paths to
+	Service.__init__ or RsService.paths) should be a conscious decision:
+	raise the budget here in the same commit. """
+
+import gc
+import tracemalloc
+
+from aiovelib.service import DoubleItem
+
+from helpers import (
+	MockSystemMonitor, make_bus, patch_settings, build_unit_values, FakeBus)
+from rsservice import RsItem
+
+# Budgets in items of the aiovelib the tests run with: what a leader or a
+# unit may cost, in DoubleItems (what a leader mostly consists of) or in
+# RsItems (what a unit mostly consists of), as measured with tracemalloc.
+# Heavier items raise the budgets in bytes, more paths or bookkeeping per
+# leader or unit does not.
+#
+# Measured on Python 3.11 with the aiovelib test stand-in used for these
+# tests. It has no release version: the ext/aiovelib submodule was not
+# checked out and upstream aiovelib could not be installed, so its figures
+# are not known yet. Replace these with its figures, and its version, when
+# it is measured.
+#   Leader: 35.4 to 36.6 KB, a DoubleItem 224 bytes, 158 to 163 items
+#   Unit:    6.6 to 7.1 KB, an RsItem 248 bytes, 27 to 29 items
+# The budgets leave about 1.5 times that.
+LEADER_BUDGET = 240 # A leader Service including its first unit
+UNIT_BUDGET = 42 # Each additional unit in a system
+
+
+async def measure(systems, units):
+	""" Bytes allocated (and still alive) for a monitor with `systems`
+	    leaders of `units` units each. """
+	gc.collect()
+	tracemalloc.start()
+	try:
+		before = tracemalloc.get_traced_memory()[0]
+		monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+		for instance in range(systems):
+			for nad in range(units):
+				values = build_unit_values(instance=instance,
+					deviceinstance=256 + instance * units + nad)
+				values["/Devices/0/Nad"] = nad
+				await monitor.add_service(
+					f"com.victronenergy.multi.mem_{instance}_{nad}", values)
+		gc.collect()
+		used = tracemalloc.get_traced_memory()[0] - before
+	finally:
+		tracemalloc.stop()
+	assert len(list(monitor.leaders)) == systems
+	return used
+
+
+def item_bytes(make, n=500):
+	""" Bytes allocated (and still alive) per object made by make(i). """
+	gc.collect()
+	tracemalloc.start()
+	try:
+		before = tracemalloc.get_traced_memory()[0]
+		items = [make(i) for i in range(n)]
+		gc.collect()
+		used = tracemalloc.get_traced_memory()[0] - before
+	finally:
+		tracemalloc.stop()
+	assert len(items) == n
+	return used / n
+
+
+async def warm_up():
+	""" Fill the process-wide caches (interned paths, the fast lane cache,
+	    etc.) once, so that they are not charged to whichever measurement
+	    happens to run first. """
+	await measure(2, 2)
+
+
+async def test_bytes_per_leader(monkeypatch):
+	patch_settings(monkeypatch)
+
+	await warm_up()
+	item = item_bytes(lambda i: DoubleItem(f"/Ac/In/1/L{i}/P", float(i)))
+	base = await measure(1, 1)
+	for count in (2, 4, 8):
+		per_leader = (await measure(count, 1) - base) / (count - 1)
+		assert per_leader < LEADER_BUDGET * item, \
+			f"{per_leader:.0f} bytes per leader with {count} leaders, " \
+			f"{per_leader / item:.0f} DoubleItems"
+
+
+async def test_bytes_per_unit(monkeypatch):
+	patch_settings(monkeypatch)
+
+	await warm_up()
+	item = item_bytes(lambda i: RsItem())
+	base = await measure(1, 1)
+	for count in (2, 3, 6):
+		per_unit = (await measure(1, count) - base) / (count - 1)
+		assert per_unit < UNIT_BUDGET * item, \
+			f"{per_unit:.0f} bytes per unit with {count} units, " \
+			f"{per_unit / item:.0f} RsItems"
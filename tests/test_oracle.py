@@ -0,0 +1,120 @@
+""" Differential tests: the aggregation engines in dbus-acsystem must give
+	exactly the same results as the frozen reference implementation, for
+	randomly generated fleets with missing and invalid values. To check a
+	new engine, add it to ENGINES. """
+
+import random
+
+import pytest
+
+import reference
+from helpers import (
+	acsystem, MockSystemMonitor, make_bus, patch_settings, build_unit_values,
+	FakeBus)
+
+# name -> function(leader) returning the calculation_loop values
+ENGINES = {
+	"aggregate": acsystem.aggregate,
+}
+
+SEEDS = range(200)
+
+MISSING = object()
+
+STATES = (0, 2, 3, 4, 5, 6, 8, 9, 10, 11, 0xF5, 0xFA, 0xFC)
+
+
+def outcome(fn, *args):
+	""" Result of fn, or the exception type it raises. Should the
+	    reference raise, the engine must raise the same. """
+	try:
+		return fn(*args)
+	except Exception as e:
+		return type(e)
+
+
+def measurement(rnd, kind="d"):
+	""" A value, an invalid value (None) or nothing at all. """
+	r = rnd.random()
+	if r < 0.15:
+		return MISSING
+	if r < 0.25:
+		return None
+	if kind == "i":
+		return rnd.randint(0, 3)
+	return round(rnd.uniform(-5000, 5000), rnd.choice((0, 1, 2)))
+
+
+def random_unit(rnd, nad):
+	values = build_unit_values(instance=1, deviceinstance=256 + nad)
+	values["/Devices/0/Nad"] = nad
+	generated = {
+		"/Dc/0/Voltage": measurement(rnd),
+		"/Dc/0/Current": measurement(rnd),
+		"/Dc/0/Power": measurement(rnd),
+		"/Soc": measurement(rnd),
+		"/State": rnd.choice(STATES),
+		"/Ac/ActiveIn/ActiveInput": rnd.choice((0, 1, 0xF0, None, MISSING)),
+		"/Ess/AcPowerSetpoint": measurement(rnd),
+	}
+	for phase in range(1, 4):
+		for io in ("In/1", "In/2", "Out"):
+			for q in "PIVF":
+				generated[f"/Ac/{io}/L{phase}/{q}"] = measurement(rnd)
+	for path, fn in reference.summaries.items():
+		if path != "/State":
+			generated[path] = measurement(rnd,
+				"d" if fn is reference.summary_sum else "i")
+	values.update((p, v) for p, v in generated.items() if v is not MISSING)
+	for p, v in generated.items():
+		if v is MISSING:
+			values.pop(p, None)
+	return values
+
+
+async def random_leader(rnd):
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	for nad in range(rnd.randint(1, 6)):
+		await monitor.add_service(f"com.victronenergy.multi.oracle_{nad}",
+			random_unit(rnd, nad))
+	leader = monitor.get_leader(1)
+	await leader.settings.set_value("/Settings/Alarm/System/GridLost",
+		rnd.choice((0, 1)))
+
+	# Units whose /State turns invalid once they have joined
+	for unit in leader.subservices:
+		if rnd.random() < 0.2:
+			unit.values["/State"].update(None)
+			monitor.itemsChanged(unit, { "/State": None })
+	return leader
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+async def test_aggregate_matches_reference(monkeypatch, engine):
+	patch_settings(monkeypatch)
+	for seed in SEEDS:
+		leader = await random_leader(random.Random(seed))
+		units = list(leader.subservices)
+		assert outcome(lambda: dict(ENGINES[engine](leader))) == \
+			outcome(reference.aggregate, units), f"seed {seed}"
+
+
+async def test_summaries_match_reference(monkeypatch):
+	patch_settings(monkeypatch)
+	assert set(acsystem.RsService.summaries) == set(reference.summaries)
+	for seed in SEEDS:
+		leader = await random_leader(random.Random(seed))
+		units = list(leader.subservices)
+		for path, fn in reference.summaries.items():
+			summary = acsystem.RsService.summaries[path]
+			assert outcome(summary.summarise, leader) == outcome(fn, units,
+				path, leader.settings.get_value), f"seed {seed}, {path}"
+
+
+async def test_total_setpoint_matches_reference(monkeypatch):
+	patch_settings(monkeypatch)
+	for seed in SEEDS:
+		leader = await random_leader(random.Random(seed))
+		assert outcome(leader._get_total_setpoint) == \
+			outcome(reference.total_setpoint, list(leader.subservices)), \
+			f"seed {seed}"
@@ -0,0 +1,17 @@
+""" The on-demand profiler writes its reports only when triggered. """
+
+from profiler import Profiler
+
+
+async def test_profile_writes_report(tmp_path):
+	profiler = Profiler(str(tmp_path), window=0)
+	path = await profiler.profile()
+	with open(path) as fp:
+		assert "function calls" in fp.read()
+
+
+async def test_trace_allocations_writes_report(tmp_path):
+	profiler = Profiler(str(tmp_path), window=0)
+	path = await profiler.trace_allocations()
+	with open(path) as fp:
+		assert fp.readline().startswith("Traced memory:")
@@ -0,0 +1,48 @@
+""" Throttling of informational aggregates under congestion. """
+
+from publish import Lanes, Throttle
+
+
+def test_throttle_backs_off_and_recovers():
+	throttle = Throttle(lag=0.25, backlog=100, max_level=2, recover=3)
+	assert throttle.due
+
+	throttle.update(0.5, 0)
+	throttle.update(0.0, 500)
+	throttle.update(0.5, 500)
+	assert throttle.level == 2
+
+	published = []
+	for _ in range(4):
+		published.append(throttle.due)
+		throttle.update(0.5, 0)
+	assert published.count(True) == 1
+
+	for _ in range(6):
+		throttle.update(0.0, 0)
+	assert throttle.level == 0
+	assert throttle.due
+
+
+def test_throttle_spares_control_paths():
+	throttle = Throttle()
+	assert throttle.is_informational("/Ac/Out/L1/V")
+	assert throttle.is_informational("/Ac/In/1/L2/F")
+	assert throttle.is_informational("/Soc")
+	assert not throttle.is_informational("/Ac/In/1/P")
+	assert not throttle.is_informational("/Ess/AcPowerSetpoint")
+	assert not throttle.is_informational("/Alarms/GridLost")
+
+
+def test_lanes_follow_phase_values_to_totals():
+	lanes = Lanes()
+	assert lanes.is_fast("/Ac/In/2/P")
+	assert lanes.is_fast("/Alarms/GridLost")
+	assert not lanes.is_fast("/Ac/Out/L1/V")
+	assert not lanes.is_fast("/Ac/In/1/L1/P") # * stays within one element
+	assert lanes.triggers("/Ac/In/1/L3/P")
+	assert not lanes.triggers("/Ac/Out/L1/P")
+
+	lanes = Lanes(["/Ac/Out/P"])
+	assert lanes.triggers("/Ac/Out/L1/P")
+	assert not lanes.triggers("/Ac/In/1/L3/P")
@@ -0,0 +1,75 @@
+""" Long-horizon behaviour, on a virtual clock. """
+
+import time
+
+from aiovelib.test.localsettings import MockSettingsMonitor
+
+from helpers import (
+	acsystem, MockSystemMonitor, make_bus, build_unit_values, FakeBus)
+from simulation import VirtualClockLoop, Scenario
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def unit(instance, nad):
+	values = build_unit_values(instance=instance, deviceinstance=256 + nad)
+	values["/Devices/0/Nad"] = nad
+	values["/Ac/Out/L1/P"] = 0.0
+	return values
+
+
+def test_virtual_clock_jumps_ahead():
+	loop = VirtualClockLoop()
+	try:
+		started = time.monotonic()
+		loop.run_until_complete(acsystem.asyncio.sleep(DAY))
+		assert loop.time() == DAY
+		assert time.monotonic() - started < 1
+	finally:
+		loop.close()
+
+
+def test_a_day_of_flapping_units(monkeypatch):
+	monkeypatch.setattr(acsystem, "SettingsMonitor", MockSettingsMonitor)
+	seen = {}
+
+	def probe(label):
+		def fn(monitor):
+			seen[label] = { i: (leader.get_item("/Ac/Out/P").value,
+				leader.get_item("/Connected").value, len(leader.subservices))
+				for i, leader in ((l.systeminstance, l) for l in monitor.leaders) }
+		return fn
+
+	scenario = Scenario()
+	scenario.join(0, "a", unit(1, 0)).join(0, "b", unit(1, 1))
+	scenario.ramp(HOUR, 5 * HOUR, "a", "/Ac/Out/L1/P", 0, 2000, step=60)
+	scenario.call(6 * HOUR, probe("ramped"))
+
+	# Firmware update on b: gone for a minute, leader retained meanwhile
+	scenario.leave(8 * HOUR, "b").leave(8 * HOUR, "a")
+	scenario.call(8 * HOUR + 5, probe("empty"))
+	scenario.join(8 * HOUR + 30, "a", unit(1, 0))
+	scenario.join(8 * HOUR + 40, "b", unit(1, 1))
+	scenario.call(8 * HOUR + 45, probe("back"))
+
+	# Re-assigned to another system in the afternoon
+	scenario.move(14 * HOUR, "b", 2)
+	scenario.set(14 * HOUR, "b", { "/Ac/Out/L1/P": 500.0 })
+	scenario.call(14 * HOUR + 5, probe("moved"))
+
+	loop = VirtualClockLoop()
+	try:
+		monitor = loop.run_until_complete(
+			MockSystemMonitor.create(FakeBus(), make_bus, retention=120))
+		started = time.monotonic()
+		loop.run_until_complete(scenario.run(monitor, DAY))
+		elapsed = time.monotonic() - started
+	finally:
+		loop.close()
+
+	assert seen["ramped"] == { 1: (2000.0, 1, 2) }
+	assert seen["empty"] == { 1: (None, 0, 0) }
+	assert seen["back"] == { 1: (0.0, 1, 2) }
+	assert seen["moved"] == { 1: (0.0, 1, 1), 2: (500.0, 1, 1) }
+	assert elapsed < 60
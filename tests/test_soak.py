@@ -0,0 +1,69 @@
+""" Churn soak test: units coming, going and changing system instance for a
+	long time must not leave anything behind. """
+
+import gc
+import os
+
+from helpers import (
+	acsystem, MockSystemMonitor, make_bus, patch_settings, build_unit_values,
+	FakeBus)
+
+CYCLES = 2000
+WARMUP = 200
+
+MULTI = "com.victronenergy.multi.soak_"
+
+
+def rss():
+	""" Resident set size in bytes, or None where /proc is not available. """
+	try:
+		with open("/proc/self/statm") as fp:
+			return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, ValueError):
+		return None
+
+
+def census():
+	gc.collect()
+	counts = { "objects": len(gc.get_objects()) }
+	for cls in (acsystem.Service, acsystem.RsService,
+			acsystem.SnapshotInterface):
+		counts[cls.__name__] = sum(1 for o in gc.get_objects()
+			if isinstance(o, cls))
+	return counts
+
+
+async def cycle(monitor):
+	values = build_unit_values(instance=1)
+	a = await monitor.add_service(MULTI + "a", values)
+	values = build_unit_values(instance=1, deviceinstance=257)
+	values["/Devices/0/Nad"] = 1
+	b = await monitor.add_service(MULTI + "b", values)
+
+	b.values["/N2kSystemInstance"].update(2)
+	await monitor.systemInstanceChanged(b)
+
+	await monitor.serviceRemoved(a)
+	await monitor.serviceRemoved(b)
+
+
+async def test_churn_leaves_nothing_behind(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	for _ in range(WARMUP):
+		await cycle(monitor)
+	before, rss_before = census(), rss()
+
+	for _ in range(CYCLES):
+		await cycle(monitor)
+	after, rss_after = census(), rss()
+
+	assert list(monitor.leaders) == []
+	assert monitor._members == {}
+	assert after["Service"] == 0
+	assert after["SnapshotInterface"] == 0
+	assert after["RsService"] <= before["RsService"]
+	assert after["objects"] - before["objects"] < 500, (before, after)
+	if rss_before is not None:
+		assert rss_after - rss_before < 4 * 1024 * 1024
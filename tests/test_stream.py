@@ -0,0 +1,152 @@
+""" The binary aggregate stream on a unix socket. """
+
+import math
+import socket
+import asyncio
+import struct
+
+import pytest
+
+from stream import Stream, Subscriber, HEADER, LAYOUT, FRAME, unpack_header
+from helpers import (
+	MockSystemMonitor, make_bus, patch_settings, build_unit_values, FakeBus,
+	acsystem)
+
+
+FIELDS = ("/Ac/Out/P", "/Soc", "/State")
+
+
+async def read_record(reader):
+	kind, instance, sequence, timestamp, length = unpack_header(
+		await reader.readexactly(HEADER.size))
+	return kind, instance, sequence, await reader.readexactly(length)
+
+
+async def wait_for_readers(stream, n):
+	while len(stream.subscribers) < n:
+		await asyncio.sleep(0)
+
+
+async def test_readers_get_layout_then_frames(tmp_path):
+	stream = Stream(str(tmp_path / "acsystem.sock"), FIELDS)
+	await stream.start()
+	try:
+		# Keep the writers, the connection closes when they are collected
+		connections = [await asyncio.open_unix_connection(stream.path)
+			for _ in range(2)]
+		await wait_for_readers(stream, 2)
+
+		stream.publish(1, {"/Ac/Out/P": 1500, "/State": 9})
+		stream.publish(1, {"/Ac/Out/P": 1600, "/Soc": 55.5})
+
+		for reader, _ in connections:
+			kind, _, _, payload = await read_record(reader)
+			assert kind == LAYOUT
+			assert tuple(payload.decode().split("\n")) == FIELDS
+
+			frame = struct.Struct("<3d")
+			kind, instance, sequence, payload = await read_record(reader)
+			assert (kind, instance, sequence) == (FRAME, 1, 1)
+			p, soc, state = frame.unpack(payload)
+			assert (p, state) == (1500, 9) and math.isnan(soc)
+
+			kind, instance, sequence, payload = await read_record(reader)
+			assert sequence == 2
+			assert frame.unpack(payload)[:2] == (1600, 55.5)
+	finally:
+		await stream.close()
+	assert not stream.subscribers
+
+
+async def test_slow_reader_loses_oldest_frames():
+	subscriber = Subscriber(writer=None, depth=3)
+	for frame in (b"1", b"2", b"3", b"4", b"5"):
+		subscriber.put(frame)
+	assert list(subscriber.queue) == [b"3", b"4", b"5"]
+	assert subscriber.dropped == 2
+
+
+async def test_leader_frame_has_aggregates_and_summaries(monkeypatch):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	unit = build_unit_values(instance=1)
+	unit["/Ac/Out/L1/P"] = 800.0
+	await monitor.add_service("com.victronenergy.multi.test", unit)
+	leader = monitor.get_leader(1)
+
+	values = acsystem.aggregate(leader)
+	values.update(leader.summary_values())
+	for p in ("/Ac/Out/P", "/Ac/NumberOfPhases", "/State"):
+		assert p in acsystem.stream_fields
+	assert set(leader.summary_values()) <= set(acsystem.stream_fields)
+	assert values["/Ac/NumberOfPhases"] == 1
+	assert values["/Ac/Out/P"] == 800.0
+	assert values["/State"] == 9
+
+
+async def test_stream_loop_idle_without_readers(monkeypatch, tmp_path):
+	patch_settings(monkeypatch)
+
+	monitor = await MockSystemMonitor.create(FakeBus(), make_bus)
+	await monitor.add_service("com.victronenergy.multi.test",
+		build_unit_values(instance=1))
+	stream = Stream(str(tmp_path / "acsystem.sock"), acsystem.stream_fields)
+
+	calls = []
+	aggregate = acsystem.aggregate
+	monkeypatch.setattr(acsystem, "aggregate",
+		lambda leader: calls.append(leader) or aggregate(leader))
+	task = asyncio.ensure_future(acsystem.stream_loop(monitor, stream, 0))
+	try:
+		for _ in range(3):
+			await asyncio.sleep(0)
+		assert calls == []
+
+		subscriber = Subscriber(writer=None, depth=4)
+		stream.subscribers.add(subscriber)
+		await asyncio.sleep(0)
+		assert calls and subscriber.queue
+	finally:
+		task.cancel()
+
+
+async def test_reader_input_is_discarded(tmp_path):
+	stream = Stream(str(tmp_path / "acsystem.sock"), FIELDS)
+	await stream.start()
+	try:
+		reader, writer = await asyncio.open_unix_connection(stream.path)
+		writer.write(b"x" * 100000)
+		await writer.drain()
+		await wait_for_readers(stream, 1)
+		kind, _, _, _ = await read_record(reader)
+		assert kind == LAYOUT
+
+		writer.close()
+		while stream.subscribers:
+			await asyncio.sleep(0)
+	finally:
+		await stream.close()
+
+
+async def test_start_replaces_stale_socket_only(tmp_path):
+	# A bound and closed socket leaves its file behind, like a crashed run
+	path = tmp_path / "acsystem.sock"
+	with socket.socket(socket.AF_UNIX) as stale:
+		stale.bind(str(path))
+	assert path.exists()
+
+	stream = Stream(str(path), FIELDS)
+	await stream.start()
+	try:
+		reader, writer = await asyncio.open_unix_connection(stream.path)
+		kind, _, _, _ = await read_record(reader)
+		assert kind == LAYOUT
+		writer.close()
+	finally:
+		await stream.close()
+
+	path.write_text("not a socket")
+	with pytest.raises(FileExistsError):
+		await Stream(str(path), FIELDS).start()
+	assert path.read_text() == "not a socket"
@@ -0,0 +1,21 @@
+try:
+	from dbus_fast import Variant
+except ImportError:
+	from dbus_next import Variant
+
+def wrap_dbus_value(value):
+	""" Wrap a python value in a Variant the way the rest of the Venus bus
+	    does, with an empty array for an invalid value. """
+	if value is None:
+		return Variant('ai', [])
+	if isinstance(value, bool):
+		return Variant('i', int(value))
+	if isinstance(value, int):
+		return Variant('i' if -0x80000000 <= value <= 0x7FFFFFFF else 'x',
+			value)
+	if isinstance(value, float):
+		return Variant('d', value)
+	return Variant('s', str(value))
+
+def wrap_dbus_dict(values):
+	return Variant('a{sv}', { k: wrap_dbus_value(v) for k, v in values.items() })